@@ -1,17 +1,21 @@
 import boto3
+import contextlib
 import psycopg2
-import json
-from psycopg2.extras import execute_values
+
+from embedding_models import ensure_registry
+from gold_loader import check_gold_model, load_gold_prefix, load_gold_stream
+from vector_index import (MAX_EF_SEARCH, VectorIndexManager, apply_search_settings, build_settings, quantized_order,
+                          shortlist_size)
 
 class RDSVectorStore:
-    def __init__(self, host, database, username, password, port=5432):
-        self.conn = psycopg2.connect(
-            host=host,
-            database=database,
-            user=username,
-            password=password,
-            port=port
-        )
+    def __init__(self, host, database, username, password, port=5432, index_kind="ivfflat", bulk_load=False):
+        # Kept so parallel loaders can open one connection per worker process
+        self.conn_params = dict(host=host, database=database, user=username, password=password, port=port)
+        self.conn = psycopg2.connect(**self.conn_params)
+        self.index_kind = index_kind
+        # In bulk-load mode the ANN index is built once, after the data is in
+        self.bulk_load = bulk_load
+        self.index = VectorIndexManager(self.conn)
         self.setup_database()
     
     def setup_database(self):
@@ -34,64 +38,99 @@ class RDSVectorStore:
                 );
             """)
             
-            # Create index for vector similarity search
-            cur.execute("""
-                CREATE INDEX IF NOT EXISTS kalshi_embedding_idx 
-                ON kalshi_documents USING ivfflat (embedding vector_cosine_ops)
-                WITH (lists = 100);
-            """)
-            
         self.conn.commit()
+        # Which model produced the vectors (adds kalshi_documents.embedding_model)
+        ensure_registry(self.conn)
+
+        # Create index for vector similarity search, sized from the current row count
+        if not self.bulk_load:
+            self.index.create_index(self.index_kind)
     
-    def load_from_s3_gold(self, s3_bucket, s3_key):
-        """Load data from S3 Gold bucket"""
+    def load_from_s3_gold(self, s3_bucket, s3_key, skip_rows=0, on_chunk=None):
+        """Stream a Gold JSON file from S3 into kalshi_documents with binary COPY.
+
+        The object is parsed incrementally, so memory stays flat however big
+        the file is; see gold_loader.load_gold_stream for skip_rows/on_chunk.
+        """
+        check_gold_model(self.conn)
         s3 = boto3.client('s3')
-        
-        # Download and parse JSON
         response = s3.get_object(Bucket=s3_bucket, Key=s3_key)
-        data = json.loads(response['Body'].read())
-        
-        # Insert data
-        with self.conn.cursor() as cur:
-            values = []
-            for item in data:
-                if item and item.get('text') and item.get('embedding'):  # Skip None entries
-                    # Check embedding dimension
-                    if len(item['embedding']) == 1024:
-                        values.append((
-                            item['text'],
-                            item['embedding'],
-                            item.get('topic', ''),
-                            item.get('source', 'kalshi'),
-                            item.get('date'),
-                            item.get('url', '')
-                        ))
-                    else:
-                        print(f"Skipping item with {len(item['embedding'])} dimensions")
-            
-            if values:
-                execute_values(
-                    cur,
-                    """INSERT INTO kalshi_documents (text, embedding, topic, source, date, url) 
-                       VALUES %s""",
-                    values
-                )
-        
-        self.conn.commit()
-        print(f"Loaded {len(values)} documents from {s3_key}")
+
+        loaded, _ = load_gold_stream(self.conn, response['Body'], skip_rows=skip_rows, on_chunk=on_chunk)
+        print(f"Loaded {loaded} documents from {s3_key}")
+        return loaded
+    
+    def load_all_from_s3_gold(self, s3_bucket, prefix, workers=None):
+        """Load every Gold file under prefix in parallel; re-runs skip or resume files via the manifest"""
+        return load_gold_prefix(self.conn_params, s3_bucket, prefix, workers=workers)
+    
+    def begin_bulk_load(self):
+        """Drop the ANN index so loads don't pay index maintenance (searches fall back to a scan)"""
+        self.bulk_load = True
+        self.index.drop_index()
+        print(f"🚚 Bulk-load mode: {self.index.index_name} dropped")
+
+    def finish_bulk_load(self, maintenance_work_mem=None, parallel_workers=None):
+        """Build the ANN index once over the loaded rows (ivfflat lists are trained on real data), then ANALYZE"""
+        self.bulk_load = False
+        return self.index.create_index(
+            self.index_kind, analyze=True,
+            settings=build_settings(maintenance_work_mem, parallel_workers)
+        )
+
+    @contextlib.contextmanager
+    def bulk_loading(self, maintenance_work_mem=None, parallel_workers=None):
+        """with store.bulk_loading(): store.load_all_from_s3_gold(...)
+
+        The index is rebuilt even if the load fails part-way, so the table is
+        never left without one.
+        """
+        self.begin_bulk_load()
+        try:
+            yield self
+        finally:
+            self.finish_bulk_load(maintenance_work_mem, parallel_workers)
     
-    def search(self, query_embedding, limit=10):
-        """Search for similar documents"""
+    def search(self, query_embedding, limit=10, probes=None, ef_search=None, quantization=None, candidates=None):
+        """Search for similar documents.
+
+        probes (ivfflat) / ef_search (HNSW) trade speed for recall on this
+        query only; see self.index.auto_tune() for picking them.
+        quantization ("halfvec" / "binary") takes a shortlist of candidates
+        rows from the quantized index (self.index.create_quantized_index)
+        and re-ranks it exactly; see self.index.quantized_recall_report().
+        """
         with self.conn.cursor() as cur:
-            cur.execute("""
-                SELECT text, topic, source, date, url,
-                       embedding <=> %s::vector as distance
-                FROM kalshi_documents
-                ORDER BY embedding <=> %s::vector
-                LIMIT %s
-            """, (query_embedding, query_embedding, limit))
+            if quantization is None:
+                apply_search_settings(cur, probes, ef_search)
+                cur.execute("""
+                    SELECT text, topic, source, date, url,
+                           embedding <=> %s::vector as distance
+                    FROM kalshi_documents
+                    ORDER BY embedding <=> %s::vector
+                    LIMIT %s
+                """, (query_embedding, query_embedding, limit))
+            else:
+                candidates = min(candidates or shortlist_size(quantization, limit), MAX_EF_SEARCH)
+                # HNSW returns at most ef_search rows, so it must cover the shortlist
+                apply_search_settings(cur, probes, max(ef_search or 40, candidates))
+                cur.execute(f"""
+                    SELECT text, topic, source, date, url,
+                           embedding <=> %s::vector as distance
+                    FROM (
+                        SELECT text, topic, source, date, url, embedding
+                        FROM kalshi_documents
+                        ORDER BY {quantized_order(quantization)}
+                        LIMIT %s
+                    ) shortlist
+                    ORDER BY distance
+                    LIMIT %s
+                """, (query_embedding, query_embedding, candidates, limit))
             
-            return cur.fetchall()
+            results = cur.fetchall()
+        # Ends the transaction so SET LOCAL settings don't leak into later calls
+        self.conn.rollback()
+        return results
 
 # Usage example
 def load_all_gold_data():
@@ -107,21 +146,14 @@ def load_all_gold_data():
         host=endpoint,
         database="postgres",
         username="postgres", 
-        password="YourSecurePassword123"
+        password="YourSecurePassword123",
+        bulk_load=True
     )
     
-    # Load all your Gold files
-    gold_files = [
-        "kalshi/kalshi_political_forecasts_20250929_072114.json",
-        "kalshi/kalshi_political_forecasts_20250929_072434.json",
-        "kalshi/kalshi_political_forecasts_20250929_072753.json",
-        "kalshi/kalshi_political_forecasts_20250929_073120.json",
-        "kalshi/kalshi_political_forecasts_20250929_073848.json",
-        "kalshi/kalshi_political_forecasts_20250929_073933.json"
-    ]
-    
-    for file_key in gold_files:
-        rds.load_from_s3_gold("kalshi-gold-anubh-001", file_key)
+    # Every Gold file under the prefix; already-loaded files are skipped.
+    # The index is built once at the end instead of maintained per insert.
+    with rds.bulk_loading():
+        rds.load_all_from_s3_gold("kalshi-gold-anubh-001", "kalshi/")
 
 if __name__ == "__main__":
     load_all_gold_data()
\ No newline at end of file
@@ -0,0 +1,451 @@
+"""Embedding model registry and zero-downtime re-embedding.
+
+kalshi_embedding_models records every model with vectors in
+kalshi_documents: its dimension, the column holding them and its status
+(active / backfilling / retired). Each row's embedding_model column names
+the model behind its active embedding. Exactly one model is active and its
+vectors always live in the embedding column, so queries never change.
+
+Upgrading the model:
+
+    python embedding_models.py register cohere.embed-english-v3 --dimension 1024
+    python embedding_models.py backfill cohere.embed-english-v3    # resumable, rerun freely
+    python embedding_models.py cutover cohere.embed-english-v3
+
+register adds nullable shadow columns (instant, no table rewrite) that
+backfill fills in id order while ingestion and queries keep using the active
+column. cutover builds the shadow ANN index concurrently (partition by
+partition on a partitioned table), then briefly holds writes while it embeds
+the stragglers and swaps the column and index names (reads only wait for the
+rename itself). The old vectors stay behind as a
+retired model, so cutting back is the same command; drop removes them.
+"""
+import argparse
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+from psycopg2.extras import execute_values
+
+from vector_index import QUANTIZATIONS, VectorIndexManager
+
+DEFAULT_MODEL_ID = "amazon.titan-embed-text-v2:0"
+DEFAULT_DIMENSION = 1024
+AWS_REGION = os.environ.get("AWS_REGION", "ap-southeast-2")
+
+# Backfill pacing: rows per transaction, concurrent Bedrock calls, sustained calls/second
+BACKFILL_BATCH_SIZE = int(os.environ.get("BACKFILL_BATCH_SIZE", "200"))
+BACKFILL_MAX_WORKERS = int(os.environ.get("BACKFILL_MAX_WORKERS", "8"))
+BACKFILL_REQUESTS_PER_SECOND = float(os.environ.get("BACKFILL_REQUESTS_PER_SECOND", "20"))
+# Ids re-checked behind the backfill position, for rows that committed out of order
+BACKFILL_OVERLAP_IDS = int(os.environ.get("BACKFILL_OVERLAP_IDS", "2000"))
+# Cutover refuses to hold the write lock while more rows than this still need embedding
+CUTOVER_MAX_STRAGGLERS = int(os.environ.get("CUTOVER_MAX_STRAGGLERS", "1000"))
+
+
+# ----------------------------------------------------------------------------
+# Registry
+# ----------------------------------------------------------------------------
+
+def create_registry(cur, table="kalshi_documents"):
+    """Registry table seeded with the current model, plus the per-row embedding_model column"""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS kalshi_embedding_models (
+            model_id VARCHAR(100) PRIMARY KEY,
+            dimension INTEGER NOT NULL,
+            column_name VARCHAR(63) NOT NULL,
+            status VARCHAR(20) NOT NULL,  -- active / backfilling / retired
+            backfill_last_id BIGINT NOT NULL DEFAULT 0,
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        );
+    """)
+    cur.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS kalshi_embedding_models_active_idx
+        ON kalshi_embedding_models (status) WHERE status = 'active';
+    """)
+    cur.execute("""
+        INSERT INTO kalshi_embedding_models (model_id, dimension, column_name, status)
+        SELECT %s, %s, 'embedding', 'active'
+        WHERE NOT EXISTS (SELECT 1 FROM kalshi_embedding_models WHERE status = 'active')
+    """, (DEFAULT_MODEL_ID, DEFAULT_DIMENSION))
+    # A constant default is metadata-only, so existing rows are labelled without a rewrite
+    cur.execute(f"""
+        ALTER TABLE {table} ADD COLUMN IF NOT EXISTS embedding_model VARCHAR(100)
+        DEFAULT '{DEFAULT_MODEL_ID}';
+    """)
+
+
+def _registry_exists(conn, table):
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT to_regclass('kalshi_embedding_models') IS NOT NULL AND EXISTS (
+                SELECT 1 FROM pg_attribute
+                WHERE attrelid = %s::regclass AND attname = 'embedding_model' AND NOT attisdropped
+            )
+        """, (table,))
+        exists = cur.fetchone()[0]
+    conn.rollback()
+    return exists
+
+
+def ensure_registry(conn, table="kalshi_documents"):
+    """create_registry on a database migration 005 has not reached yet.
+
+    Only a catalog lookup once the registry exists: ALTER TABLE ... ADD COLUMN
+    IF NOT EXISTS takes an ACCESS EXCLUSIVE lock on table before its check.
+    """
+    if _registry_exists(conn, table):
+        return
+    with conn.cursor() as cur:
+        create_registry(cur, table)
+    conn.commit()
+
+
+def active_model(conn):
+    """(model_id, dimension) whose vectors are in the embedding column"""
+    with conn.cursor() as cur:
+        cur.execute("SELECT to_regclass('kalshi_embedding_models') IS NOT NULL")
+        row = None
+        if cur.fetchone()[0]:
+            cur.execute("SELECT model_id, dimension FROM kalshi_embedding_models WHERE status = 'active'")
+            row = cur.fetchone()
+    conn.rollback()
+    return tuple(row) if row else (DEFAULT_MODEL_ID, DEFAULT_DIMENSION)
+
+
+def get_model(conn, model_id):
+    """(dimension, column_name, status, backfill_last_id) for a registered model"""
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT dimension, column_name, status, backfill_last_id
+            FROM kalshi_embedding_models WHERE model_id = %s
+        """, (model_id,))
+        row = cur.fetchone()
+    conn.rollback()
+    if row is None:
+        raise ValueError(f"{model_id} is not registered")
+    return row
+
+
+def list_models(conn):
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT model_id, dimension, column_name, status, backfill_last_id, updated_at
+            FROM kalshi_embedding_models ORDER BY created_at
+        """)
+        rows = cur.fetchall()
+    conn.rollback()
+    return rows
+
+
+def shadow_column(model_id):
+    """Column that holds a model's vectors while it is not the active one"""
+    slug = re.sub(r"[^a-z0-9]+", "_", model_id.lower()).strip("_")
+    # Leaves room for the _model / _idx suffixes within Postgres' 63-character limit
+    return f"embedding_{slug}"[:50]
+
+
+def register_model(conn, model_id, dimension, table="kalshi_documents"):
+    """Register a new model and add its shadow columns (nullable, so no rewrite)"""
+    ensure_registry(conn, table)
+    column = shadow_column(model_id)
+    with conn.cursor() as cur:
+        cur.execute("SELECT status, dimension FROM kalshi_embedding_models WHERE model_id = %s", (model_id,))
+        existing = cur.fetchone()
+        if existing:
+            conn.rollback()
+            if existing[1] != dimension:
+                raise ValueError(f"{model_id} is already registered with {existing[1]} dimensions")
+            print(f"⏭️ {model_id} already registered ({existing[0]})")
+            return column
+        cur.execute(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {column} vector({int(dimension)});")
+        cur.execute(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {column}_model VARCHAR(100);")
+        cur.execute("""
+            INSERT INTO kalshi_embedding_models (model_id, dimension, column_name, status)
+            VALUES (%s, %s, %s, 'backfilling')
+        """, (model_id, dimension, column))
+    conn.commit()
+    print(f"✅ Registered {model_id} ({dimension} dims) in shadow column {column}")
+    return column
+
+
+# ----------------------------------------------------------------------------
+# Bedrock
+# ----------------------------------------------------------------------------
+
+def embedding_request_body(model_id, text, dimension, input_type="search_document"):
+    """Bedrock request body for the model family (input_type only matters to Cohere)"""
+    if model_id.startswith("cohere.embed"):
+        return json.dumps({"texts": [text], "input_type": input_type, "truncate": "END"})
+    body = {"inputText": text}
+    # Titan v2 takes the output size (256 / 512 / 1024); v1 is fixed at 1536
+    if "titan-embed-text-v2" in model_id:
+        body["dimensions"] = dimension
+    return json.dumps(body)
+
+
+def parse_embedding(model_id, payload):
+    if model_id.startswith("cohere.embed"):
+        return payload.get("embeddings", [[]])[0]
+    return payload.get("embedding", [])
+
+
+def embed(bedrock, model_id, text, dimension):
+    response = bedrock.invoke_model(
+        modelId=model_id,
+        body=embedding_request_body(model_id, text, dimension),
+        contentType="application/json",
+        accept="application/json"
+    )
+    embedding = parse_embedding(model_id, json.loads(response["body"].read()))
+    if len(embedding) != dimension:
+        raise ValueError(f"{model_id} returned {len(embedding)} dimensions, registry says {dimension}")
+    return embedding
+
+
+class RateLimiter:
+    """Blocking limiter spacing calls 1/rate seconds apart, shared by the embedding threads"""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self._lock = threading.Lock()
+        self._next = time.monotonic()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            self._next = max(self._next, now)
+            delay, self._next = self._next - now, self._next + 1.0 / self.rate
+        if delay > 0:
+            time.sleep(delay)
+
+
+# ----------------------------------------------------------------------------
+# Backfill
+# ----------------------------------------------------------------------------
+
+def _embed_batch(cur, pool, embed_one, model_id, table, column, rows):
+    """Embed rows [(id, text)] and write them to column, in the caller's transaction"""
+    embeddings = list(pool.map(embed_one, [text for _, text in rows]))
+    execute_values(cur, f"""
+        UPDATE {table} AS d
+        SET {column} = v.embedding::vector, {column}_model = v.model
+        FROM (VALUES %s) AS v(id, embedding, model)
+        WHERE d.id = v.id
+    """, [(doc_id, "[" + ",".join(map(repr, vector)) + "]", model_id)
+          for (doc_id, _), vector in zip(rows, embeddings)])
+
+
+def backfill(conn, model_id, table="kalshi_documents", batch_size=None, max_workers=None,
+             requests_per_second=None, from_id=None, max_batches=None):
+    """Re-embed rows into the model's shadow column in id order, one transaction per batch.
+
+    The position (backfill_last_id) commits with each batch, so an
+    interrupted run resumes where it stopped, and rows ingested meanwhile
+    are picked up as the loop reaches them. Returns the rows embedded.
+    """
+    dimension, column, status, last_id = get_model(conn, model_id)
+    if status == "active":
+        raise ValueError(f"{model_id} is already active")
+    last_id = last_id if from_id is None else from_id
+    batch_size = batch_size or BACKFILL_BATCH_SIZE
+    limiter = RateLimiter(requests_per_second or BACKFILL_REQUESTS_PER_SECOND)
+    bedrock = boto3.client("bedrock-runtime", region_name=AWS_REGION)
+
+    def embed_one(text):
+        limiter.wait()
+        return embed(bedrock, model_id, text, dimension)
+
+    done, batches = 0, 0
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_workers or BACKFILL_MAX_WORKERS) as pool:
+        while max_batches is None or batches < max_batches:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute(f"""
+                        SELECT id, text FROM {table}
+                        WHERE id > %s AND {column} IS NULL AND text IS NOT NULL
+                        ORDER BY id
+                        LIMIT %s
+                    """, (last_id, batch_size))
+                    rows = cur.fetchall()
+                    if not rows:
+                        break
+                    _embed_batch(cur, pool, embed_one, model_id, table, column, rows)
+                    cur.execute("""
+                        UPDATE kalshi_embedding_models
+                        SET backfill_last_id = %s, updated_at = CURRENT_TIMESTAMP
+                        WHERE model_id = %s
+                    """, (rows[-1][0], model_id))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            last_id = rows[-1][0]
+            done += len(rows)
+            batches += 1
+            print(f"🔁 {model_id}: {done} rows re-embedded (last id {last_id}, "
+                  f"{done / (time.perf_counter() - started):.1f} rows/s)")
+    conn.rollback()
+    print(f"✅ {model_id} backfill caught up: {done} rows this run")
+    return done
+
+
+# ----------------------------------------------------------------------------
+# Cutover / drop
+# ----------------------------------------------------------------------------
+
+def _index_exists(cur, name):
+    cur.execute("SELECT to_regclass(%s) IS NOT NULL", (name,))
+    return cur.fetchone()[0]
+
+
+def cutover(conn, model_id, table="kalshi_documents", index_kind=None):
+    """Make a backfilled model the active one without stopping ingestion or queries.
+
+    Builds the shadow column's ANN index (and any quantized indexes the
+    active column has) first, then in one transaction: holds writes, embeds
+    rows the backfill has not reached, renames the active columns/indexes to
+    the old model's shadow names and the shadow ones to embedding /
+    kalshi_embedding_idx, and updates the registry.
+    """
+    dimension, column, status, last_id = get_model(conn, model_id)
+    if status == "active":
+        print(f"⏭️ {model_id} is already active")
+        return
+    old_model_id, old_dimension = active_model(conn)
+    old_column = shadow_column(old_model_id)
+    active = VectorIndexManager(conn, table=table, dim=old_dimension)
+    shadow = VectorIndexManager(conn, table=table, column=column, index_name=f"{column}_idx", dim=dimension)
+    retired = VectorIndexManager(conn, table=table, column=old_column, index_name=f"{old_column}_idx",
+                                 dim=old_dimension)
+
+    # Catch up outside the lock first, re-checking ids that may have committed late
+    backfill(conn, model_id, table=table, from_id=max(0, last_id - BACKFILL_OVERLAP_IDS))
+    with conn.cursor() as cur:
+        cur.execute(f"SELECT COUNT(*) FROM {table} WHERE {column} IS NULL AND text IS NOT NULL")
+        remaining = cur.fetchone()[0]
+    conn.rollback()
+    if remaining > CUTOVER_MAX_STRAGGLERS:
+        raise RuntimeError(f"{remaining} rows still have no {model_id} embedding; run backfill first")
+
+    current = active.current_index()
+    shadow.create_index(index_kind or (current[0] if current else "ivfflat"), concurrently=True)
+    with conn.cursor() as cur:
+        quantized = [q for q in QUANTIZATIONS if _index_exists(cur, active.quantized_index_name(q))]
+    conn.rollback()
+    for quantization in quantized:
+        shadow.create_quantized_index(quantization, concurrently=True)
+
+    limiter = RateLimiter(BACKFILL_REQUESTS_PER_SECOND)
+    bedrock = boto3.client("bedrock-runtime", region_name=AWS_REGION)
+
+    def embed_one(text):
+        limiter.wait()
+        return embed(bedrock, model_id, text, dimension)
+
+    started = time.perf_counter()
+    try:
+        with conn.cursor() as cur, ThreadPoolExecutor(max_workers=BACKFILL_MAX_WORKERS) as pool:
+            # Writers queue behind this; readers only wait once the renames take ACCESS EXCLUSIVE
+            cur.execute(f"LOCK TABLE {table} IN SHARE ROW EXCLUSIVE MODE")
+            cur.execute(f"SELECT id, text FROM {table} WHERE {column} IS NULL AND text IS NOT NULL ORDER BY id")
+            stragglers = cur.fetchall()
+            if stragglers:
+                _embed_batch(cur, pool, embed_one, model_id, table, column, stragglers)
+
+            renames = [
+                (f"ALTER TABLE {table} RENAME COLUMN embedding TO {old_column}",
+                 f"ALTER TABLE {table} RENAME COLUMN embedding_model TO {old_column}_model"),
+                (f"ALTER TABLE {table} RENAME COLUMN {column} TO embedding",
+                 f"ALTER TABLE {table} RENAME COLUMN {column}_model TO embedding_model"),
+            ]
+            for statements in renames:
+                for statement in statements:
+                    cur.execute(statement)
+            cur.execute(f"ALTER TABLE {table} ALTER COLUMN {old_column}_model DROP DEFAULT")
+            cur.execute(f"ALTER TABLE {table} ALTER COLUMN embedding_model SET DEFAULT %s", (model_id,))
+
+            index_pairs = [(active.index_name, retired.index_name, shadow.index_name)]
+            index_pairs += [(active.quantized_index_name(q), retired.quantized_index_name(q),
+                             shadow.quantized_index_name(q)) for q in quantized]
+            for active_name, retired_name, shadow_name in index_pairs:
+                if _index_exists(cur, active_name):
+                    cur.execute(f"ALTER INDEX {active_name} RENAME TO {retired_name}")
+                cur.execute(f"ALTER INDEX {shadow_name} RENAME TO {active_name}")
+
+            cur.execute("""
+                UPDATE kalshi_embedding_models
+                SET status = 'retired', column_name = %s, backfill_last_id = 0, updated_at = CURRENT_TIMESTAMP
+                WHERE model_id = %s
+            """, (old_column, old_model_id))
+            cur.execute("""
+                UPDATE kalshi_embedding_models
+                SET status = 'active', column_name = 'embedding', updated_at = CURRENT_TIMESTAMP
+                WHERE model_id = %s
+            """, (model_id,))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    print(f"✅ {model_id} is active ({len(stragglers)} stragglers embedded, writes blocked for "
+          f"{time.perf_counter() - started:.1f}s); {old_model_id} retired to {old_column}")
+
+
+def drop_model(conn, model_id, table="kalshi_documents"):
+    """Drop a retired model's columns (and with them its indexes) and registry entry"""
+    _, column, status, _ = get_model(conn, model_id)
+    if status == "active":
+        raise ValueError(f"{model_id} is active; cut over to another model first")
+    with conn.cursor() as cur:
+        cur.execute(f"ALTER TABLE {table} DROP COLUMN IF EXISTS {column}")
+        cur.execute(f"ALTER TABLE {table} DROP COLUMN IF EXISTS {column}_model")
+        cur.execute("DELETE FROM kalshi_embedding_models WHERE model_id = %s", (model_id,))
+    conn.commit()
+    print(f"🗑️ Dropped {model_id} ({column})")
+
+
+if __name__ == "__main__":
+    from migrate_kalshi_documents import get_connection
+
+    parser = argparse.ArgumentParser(description="Manage kalshi_documents embedding models")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("list", help="show registered models")
+    register = commands.add_parser("register", help="add a model and its shadow columns")
+    register.add_argument("model_id")
+    register.add_argument("--dimension", type=int, required=True)
+    run = commands.add_parser("backfill", help="embed rows into the model's shadow column (resumable)")
+    run.add_argument("model_id")
+    run.add_argument("--batch-size", type=int)
+    run.add_argument("--workers", type=int)
+    run.add_argument("--requests-per-second", type=float)
+    run.add_argument("--from-id", type=int, help="restart from this id instead of the saved position")
+    switch = commands.add_parser("cutover", help="make a backfilled model the active one")
+    switch.add_argument("model_id")
+    switch.add_argument("--index-kind", choices=("ivfflat", "hnsw"))
+    drop = commands.add_parser("drop", help="drop a retired model's vectors")
+    drop.add_argument("model_id")
+    args = parser.parse_args()
+
+    connection = get_connection()
+    try:
+        if args.command == "list":
+            ensure_registry(connection)
+            for model in list_models(connection):
+                print(" | ".join(str(value) for value in model))
+        elif args.command == "register":
+            register_model(connection, args.model_id, args.dimension)
+        elif args.command == "backfill":
+            backfill(connection, args.model_id, batch_size=args.batch_size, max_workers=args.workers,
+                     requests_per_second=args.requests_per_second, from_id=args.from_id)
+        elif args.command == "cutover":
+            cutover(connection, args.model_id, index_kind=args.index_kind)
+        elif args.command == "drop":
+            drop_model(connection, args.model_id)
+    finally:
+        connection.close()
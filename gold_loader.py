@@ -0,0 +1,373 @@
+import io
+import itertools
+import json
+import os
+import struct
+import sys
+from array import array
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+
+import boto3
+import psycopg2
+
+from embedding_models import active_model
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+# Model the Gold job embedded with; loads are refused unless it is the active one
+GOLD_EMBED_MODEL_ID = os.environ.get("GOLD_EMBED_MODEL_ID", "amazon.titan-embed-text-v2:0")
+EMBEDDING_DIM = int(os.environ.get("GOLD_EMBEDDING_DIM", "1024"))
+# Loaded in this order, minus any the target table lacks (older schemas have no url)
+GOLD_COLUMNS = ("text", "embedding", "topic", "source", "date", "url", "embedding_model")
+# Source items per COPY / transaction, i.e. how much work a failure can lose
+COPY_CHUNK_ROWS = 20000
+READ_CHUNK_BYTES = 1 << 20
+GOLD_LOAD_WORKERS = int(os.environ.get("GOLD_LOAD_WORKERS", "4"))
+
+_COPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack("!ii", 0, 0)
+_COPY_TRAILER = struct.pack("!h", -1)
+_NULL = struct.pack("!i", -1)
+_PG_EPOCH = datetime(2000, 1, 1)
+# Same sentinel migration 004 gives undated rows: they land in the DEFAULT
+# partition and fall outside every time window instead of looking brand new
+UNDATED = datetime(1970, 1, 1)
+_END = object()
+
+
+def iter_json_array(stream, chunk_size=READ_CHUNK_BYTES):
+    """Yield the elements of a top-level JSON array read incrementally from a byte stream"""
+    if ijson is not None:
+        yield from ijson.items(stream, "item", use_float=True)
+        return
+
+    decoder = json.JSONDecoder()
+    buffer, pos, started = "", 0, False
+    chunks = iter(lambda: stream.read(chunk_size), b"")
+    pending = b""
+    for chunk in chunks:
+        # Carry over a UTF-8 sequence split across reads
+        data = pending + chunk
+        try:
+            text, pending = data.decode("utf-8"), b""
+        except UnicodeDecodeError as e:
+            text, pending = data[:e.start].decode("utf-8"), data[e.start:]
+        buffer = buffer[pos:] + text
+        pos = 0
+        while True:
+            while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+                pos += 1
+            if pos >= len(buffer):
+                break
+            if not started:
+                if buffer[pos] != "[":
+                    raise ValueError("Gold file is not a JSON array")
+                started, pos = True, pos + 1
+                continue
+            if buffer[pos] == "]":
+                return
+            try:
+                item, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                # Element continues in the next chunk
+                break
+            yield item
+            pos = end
+    if started and buffer[pos:].strip() not in ("", "]"):
+        raise ValueError("Gold file ended inside an element")
+
+
+def _field(value):
+    if value is None:
+        return _NULL
+    return struct.pack("!i", len(value)) + value
+
+
+def _text(value):
+    return None if value is None else str(value).encode("utf-8")
+
+
+def encode_vector(embedding):
+    """pgvector binary format: int16 dim, int16 unused, big-endian float32 values"""
+    values = array("f", embedding)
+    if sys.byteorder == "little":
+        values.byteswap()
+    return struct.pack("!hh", len(values), 0) + values.tobytes()
+
+
+def encode_timestamp(value):
+    """Postgres binary timestamp (int64 microseconds since 2000-01-01); UNDATED if missing or unparseable"""
+    # date is NOT NULL and the partition key, so a NULL would fail the whole chunk
+    try:
+        moment = datetime.fromisoformat(str(value).replace("Z", "+00:00")) if value else UNDATED
+    except ValueError:
+        moment = UNDATED
+    if moment.tzinfo is not None:
+        moment = moment.replace(tzinfo=None) - moment.utcoffset()
+    delta = moment - _PG_EPOCH
+    return struct.pack("!q", (delta.days * 86400 + delta.seconds) * 1_000_000 + delta.microseconds)
+
+
+def encode_row(item, model_id=GOLD_EMBED_MODEL_ID, columns=GOLD_COLUMNS):
+    """One binary COPY tuple of columns for a Gold item, or None if it has no text or a wrong-sized embedding"""
+    if not item or not item.get("text") or not item.get("embedding"):
+        return None
+    if len(item["embedding"]) != EMBEDDING_DIM:
+        return None
+    values = {
+        "text": lambda: _text(item["text"]),
+        "embedding": lambda: encode_vector(item["embedding"]),
+        "topic": lambda: _text(item.get("topic", "")),
+        "source": lambda: _text(item.get("source", "kalshi")),
+        "date": lambda: encode_timestamp(item.get("date")),
+        "url": lambda: _text(item.get("url", "")),
+        "embedding_model": lambda: _text(model_id),
+    }
+    fields = [values[column]() for column in columns]
+    return struct.pack("!h", len(fields)) + b"".join(_field(value) for value in fields)
+
+
+class CopyStream(io.RawIOBase):
+    """File-like view over an iterator of byte strings, for cursor.copy_expert"""
+
+    def __init__(self, pieces):
+        self._pieces = pieces
+        self._buffer = b""
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            piece = next(self._pieces, None)
+            if piece is None:
+                break
+            self._buffer += piece
+        if size < 0:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+
+def gold_columns(conn, table="kalshi_documents"):
+    """GOLD_COLUMNS that table actually has, in COPY order"""
+    with conn.cursor() as cur:
+        cur.execute("SELECT attname FROM pg_attribute WHERE attrelid = %s::regclass AND attnum > 0 AND NOT attisdropped",
+                    (table,))
+        existing = {row[0] for row in cur.fetchall()}
+    conn.commit()
+    return tuple(column for column in GOLD_COLUMNS if column in existing)
+
+
+def check_gold_model(conn):
+    """Raise unless Gold vectors (GOLD_EMBED_MODEL_ID, EMBEDDING_DIM) match the active model"""
+    model_id, dimension = active_model(conn)
+    if (model_id, dimension) != (GOLD_EMBED_MODEL_ID, EMBEDDING_DIM):
+        raise ValueError(
+            f"Gold embeddings are {GOLD_EMBED_MODEL_ID} ({EMBEDDING_DIM} dims) but kalshi_documents holds "
+            f"{model_id} ({dimension} dims); re-embed the Gold files or set GOLD_EMBED_MODEL_ID/GOLD_EMBEDDING_DIM"
+        )
+
+
+def load_gold_stream(conn, stream, table="kalshi_documents", chunk_rows=COPY_CHUNK_ROWS,
+                     skip_rows=0, on_chunk=None):
+    """Stream a Gold JSON array into table with binary COPY, one transaction per chunk.
+
+    Each chunk is COPied into a temp staging table and moved across with
+    ON CONFLICT DO NOTHING, so rows already stored (unique_document) are
+    skipped rather than failing the chunk; re-runs and overlapping files are safe.
+    The first skip_rows source items are skipped (to resume a partial load).
+    on_chunk(cur, items_done, rows_loaded), if given, runs inside each
+    chunk's transaction just before the commit (both counts cumulative for
+    this call), so progress can be recorded atomically with the rows.
+    Returns (rows_loaded, rows_invalid).
+    """
+    items = itertools.islice(iter_json_array(stream), skip_rows, None)
+    items_done, loaded, invalid, duplicates = skip_rows, 0, 0, 0
+    columns = gold_columns(conn, table)
+    column_list = ", ".join(columns)
+    staging_sql = f"CREATE TEMP TABLE gold_staging ON COMMIT DROP AS SELECT {column_list} FROM {table} WITH NO DATA"
+    copy_sql = f"COPY gold_staging ({column_list}) FROM STDIN WITH (FORMAT binary)"
+    insert_sql = (f"INSERT INTO {table} ({column_list}) SELECT {column_list} FROM gold_staging "
+                  f"ON CONFLICT DO NOTHING")
+
+    while True:
+        # Gold files contain null entries, so None can't mark the end
+        first = next(items, _END)
+        if first is _END:
+            break
+        counts = {"items": 0, "invalid": 0}
+
+        def encoded_rows(chunk):
+            # Encoded lazily as COPY pulls, so only the current row's floats are alive
+            for item in chunk:
+                counts["items"] += 1
+                row = encode_row(item, columns=columns)
+                if row is None:
+                    counts["invalid"] += 1
+                else:
+                    yield row
+
+        chunk = itertools.chain([first], itertools.islice(items, chunk_rows - 1))
+        try:
+            with conn.cursor() as cur:
+                cur.execute(staging_sql)
+                rows = itertools.chain([_COPY_HEADER], encoded_rows(chunk), [_COPY_TRAILER])
+                cur.copy_expert(copy_sql, CopyStream(rows))
+                cur.execute(insert_sql)
+                inserted = cur.rowcount
+                if on_chunk is not None:
+                    on_chunk(cur, items_done + counts["items"], loaded + inserted)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        items_done += counts["items"]
+        loaded += inserted
+        invalid += counts["invalid"]
+        duplicates += counts["items"] - counts["invalid"] - inserted
+
+    if duplicates:
+        print(f"⏭️ Skipped {duplicates} items already in {table}")
+    if invalid:
+        print(f"⚠️ Skipped {invalid} items without text or with an embedding that is not "
+              f"{EMBEDDING_DIM}-dim {GOLD_EMBED_MODEL_ID}")
+    return loaded, invalid
+
+
+# ----------------------------------------------------------------------------
+# Multi-file loads with a manifest
+# ----------------------------------------------------------------------------
+
+def ensure_manifest(conn):
+    """Per-file load state: a rerun skips complete files and resumes partial ones at rows_done"""
+    with conn.cursor() as cur:
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS kalshi_gold_load_manifest (
+                s3_key TEXT PRIMARY KEY,
+                etag VARCHAR(100) NOT NULL,
+                status VARCHAR(20) NOT NULL DEFAULT 'loading',  -- loading / complete
+                rows_done INTEGER NOT NULL DEFAULT 0,    -- source items consumed
+                rows_loaded INTEGER NOT NULL DEFAULT 0,  -- rows inserted
+                updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+            );
+        """)
+    conn.commit()
+
+
+def discover_gold_keys(bucket, prefix, s3=None):
+    """[(key, etag)] of every .json object under prefix"""
+    s3 = s3 or boto3.client("s3")
+    keys = []
+    for page in s3.get_paginator("list_objects_v2").paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get("Contents", []):
+            if obj["Key"].endswith(".json"):
+                keys.append((obj["Key"], obj["ETag"].strip('"')))
+    return keys
+
+
+def _record_progress(cur, key, etag, rows_done, rows_loaded, status="loading"):
+    cur.execute("""
+        INSERT INTO kalshi_gold_load_manifest (s3_key, etag, status, rows_done, rows_loaded)
+        VALUES (%s, %s, %s, %s, %s)
+        ON CONFLICT (s3_key) DO UPDATE SET
+            etag = EXCLUDED.etag, status = EXCLUDED.status, rows_done = EXCLUDED.rows_done,
+            rows_loaded = EXCLUDED.rows_loaded, updated_at = CURRENT_TIMESTAMP
+    """, (key, etag, status, rows_done, rows_loaded))
+
+
+def load_gold_file(conn, s3, bucket, key, etag, table="kalshi_documents"):
+    """Load one Gold file under the manifest; returns (status, rows_loaded_now)"""
+    with conn.cursor() as cur:
+        # Another worker or run already has this file
+        cur.execute("SELECT pg_try_advisory_lock(hashtext('kalshi_gold_load_manifest'), hashtext(%s))", (key,))
+        if not cur.fetchone()[0]:
+            conn.rollback()
+            return "busy", 0
+        cur.execute("SELECT etag, status, rows_done, rows_loaded FROM kalshi_gold_load_manifest WHERE s3_key = %s",
+                    (key,))
+        previous = cur.fetchone()
+    conn.commit()
+
+    try:
+        skip_rows, already_loaded = 0, 0
+        if previous and previous[0] == etag:
+            if previous[1] == "complete":
+                return "skipped", 0
+            skip_rows, already_loaded = previous[2], previous[3]
+        elif previous:
+            print(f"⚠️ {key} changed since it was loaded (ETag {previous[0]} -> {etag}); "
+                  f"loading the new version, rows from the old one are left in place and repeats skipped")
+
+        body = s3.get_object(Bucket=bucket, Key=key, IfMatch=etag)["Body"]
+        loaded, _ = load_gold_stream(
+            conn, body, table=table, skip_rows=skip_rows,
+            on_chunk=lambda cur, done, rows: _record_progress(cur, key, etag, done, already_loaded + rows)
+        )
+        with conn.cursor() as cur:
+            cur.execute("""
+                INSERT INTO kalshi_gold_load_manifest (s3_key, etag, status, rows_done, rows_loaded)
+                VALUES (%s, %s, 'complete', %s, %s)
+                ON CONFLICT (s3_key) DO UPDATE SET status = 'complete', updated_at = CURRENT_TIMESTAMP
+            """, (key, etag, skip_rows, already_loaded))
+        conn.commit()
+        print(f"✅ {key}: {loaded} rows{f' (resumed at item {skip_rows})' if skip_rows else ''}")
+        return "loaded", loaded
+    finally:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_unlock(hashtext('kalshi_gold_load_manifest'), hashtext(%s))", (key,))
+        conn.commit()
+
+
+_worker = {}
+
+
+def _init_worker(conn_params):
+    # One connection and S3 client per process, reused for every file it loads
+    _worker["conn_params"] = conn_params
+    _worker["conn"] = psycopg2.connect(**conn_params)
+    _worker["s3"] = boto3.client("s3")
+
+
+def _load_in_worker(bucket, key, etag, table):
+    try:
+        return key, *load_gold_file(_worker["conn"], _worker["s3"], bucket, key, etag, table)
+    except Exception as e:
+        print(f"❌ {key}: {e}")
+        try:
+            _worker["conn"].rollback()
+        except psycopg2.Error:
+            _worker["conn"] = psycopg2.connect(**_worker["conn_params"])
+        return key, "failed", 0
+
+
+def load_gold_prefix(conn_params, bucket, prefix, workers=None, table="kalshi_documents"):
+    """Load every Gold file under prefix in a process pool, one connection per worker.
+
+    Safe to re-run: files recorded complete for the same ETag are skipped and
+    interrupted ones resume after their last committed chunk. Returns
+    {status: file count} plus the total rows loaded.
+    """
+    conn = psycopg2.connect(**conn_params)
+    try:
+        check_gold_model(conn)
+        ensure_manifest(conn)
+    finally:
+        conn.close()
+
+    keys = discover_gold_keys(bucket, prefix)
+    workers = workers or GOLD_LOAD_WORKERS
+    print(f"📦 {len(keys)} Gold files under s3://{bucket}/{prefix}, {workers} workers")
+
+    summary = {"loaded": 0, "skipped": 0, "busy": 0, "failed": 0, "rows": 0}
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(conn_params,)) as pool:
+        futures = [pool.submit(_load_in_worker, bucket, key, etag, table) for key, etag in keys]
+        for future in as_completed(futures):
+            _, status, rows = future.result()
+            summary[status] += 1
+            summary["rows"] += rows
+    print(f"✅ Gold load finished: {summary}")
+    return summary
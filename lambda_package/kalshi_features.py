@@ -0,0 +1,91 @@
+import os
+import numpy as np
+import pandas as pd
+
+# Look-back windows summarised per (Question, Option), e.g. "1d,7d,30d"
+KALSHI_WINDOWS = os.environ.get("KALSHI_WINDOWS", "1d,7d,30d")
+
+KEYS = ["Question", "Option"]
+
+
+def parse_windows(spec=None):
+    """Turn "12h,7d" into [("12h", Timedelta), ("7d", Timedelta)]"""
+    return [(w.strip(), pd.Timedelta(w.strip())) for w in (spec or KALSHI_WINDOWS).split(",") if w.strip()]
+
+
+def load_forecasts(source):
+    """Read kalshi_political_forecasts.csv (Question, Option, Date, Odds (%)) into typed columns"""
+    df = pd.read_csv(source, usecols=["Question", "Option", "Date", "Odds (%)"])
+    df = df.rename(columns={"Odds (%)": "odds"})
+    df["Date"] = pd.to_datetime(df["Date"], errors="coerce")
+    df["odds"] = pd.to_numeric(df["odds"], errors="coerce")
+    df = df.dropna(subset=["Question", "Option", "Date", "odds"])
+    return df.sort_values(KEYS + ["Date"], kind="mergesort").reset_index(drop=True)
+
+
+def summarize_forecasts(df, windows=None):
+    """One feature row per (Question, Option, window), computed with grouped vector ops.
+
+    Each window ends at the option's latest point. Features: latest odds,
+    change over the window, volatility (std of point-to-point changes) and
+    momentum (least-squares slope in odds points per day).
+    """
+    if df.empty:
+        return pd.DataFrame()
+
+    df = df.copy()
+    grouped = df.groupby(KEYS, sort=False)
+    df["latest_date"] = grouped["Date"].transform("max")
+    df["latest_odds"] = grouped["odds"].transform("last")
+    # Days before the latest point (<= 0), the regression x-axis
+    df["t"] = (df["Date"] - df["latest_date"]).dt.total_seconds().to_numpy() / 86400.0
+
+    frames = []
+    for label, span in parse_windows(windows):
+        sub = df[df["Date"] >= df["latest_date"] - span].copy()
+        sub["step"] = sub.groupby(KEYS, sort=False)["odds"].diff()
+        sub["tt"] = sub["t"] * sub["t"]
+        sub["ty"] = sub["t"] * sub["odds"]
+
+        agg = sub.groupby(KEYS, sort=False).agg(
+            latest_date=("latest_date", "first"),
+            latest_odds=("latest_odds", "first"),
+            first_odds=("odds", "first"),
+            low=("odds", "min"),
+            high=("odds", "max"),
+            volatility=("step", "std"),
+            points=("odds", "size"),
+            sum_t=("t", "sum"),
+            sum_y=("odds", "sum"),
+            sum_tt=("tt", "sum"),
+            sum_ty=("ty", "sum"),
+        )
+
+        n = agg["points"].to_numpy(dtype=float)
+        denom = n * agg["sum_tt"].to_numpy() - agg["sum_t"].to_numpy() ** 2
+        numer = n * agg["sum_ty"].to_numpy() - agg["sum_t"].to_numpy() * agg["sum_y"].to_numpy()
+        with np.errstate(divide="ignore", invalid="ignore"):
+            agg["momentum"] = np.where(denom > 0, numer / denom, 0.0)
+
+        agg["delta"] = agg["latest_odds"] - agg["first_odds"]
+        agg["volatility"] = agg["volatility"].fillna(0.0)
+        agg["window"] = label
+        frames.append(agg.drop(columns=["sum_t", "sum_y", "sum_tt", "sum_ty", "first_odds"]))
+
+    return pd.concat(frames).reset_index()
+
+
+def summary_text(row):
+    """Market line in the prompt's Question,Option,Date,Odds % layout plus window features"""
+    return (
+        f"{row.Question},{row.Option},{row.latest_date:%Y-%m-%d %H:%M},{row.latest_odds:.1f}% | "
+        f"{row.window} change {row.delta:+.1f} pts, volatility {row.volatility:.2f}, "
+        f"momentum {row.momentum:+.2f} pts/day, range {row.low:.1f}-{row.high:.1f}, {row.points} points"
+    )
+
+
+def iter_kalshi_documents(source, windows=None):
+    """Yield (text, topic, date) documents, one per option per window"""
+    summary = summarize_forecasts(load_forecasts(source), windows)
+    for row in summary.itertuples(index=False):
+        yield summary_text(row), row.Question, f"{row.latest_date:%Y-%m-%d %H:%M}"
@@ -2,99 +2,635 @@ import boto3
 import json
 import os
 import csv
-from io import StringIO
-import datetime
+import time
+import hashlib
+import unicodedata
+import codecs
+import itertools
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from botocore.config import Config
+
+# Embedding concurrency (Bedrock calls are network bound, so threads are enough)
+EMBED_BATCH_SIZE = int(os.environ.get("EMBED_BATCH_SIZE", "16"))
+EMBED_MAX_WORKERS = int(os.environ.get("EMBED_MAX_WORKERS", "8"))
+
+# Bulk insert chunking (one Data API call + one transaction per chunk)
+INSERT_BATCH_SIZE = int(os.environ.get("INSERT_BATCH_SIZE", "50"))
+INSERT_MAX_RETRIES = int(os.environ.get("INSERT_MAX_RETRIES", "3"))
+
+# Records of one S3/SQS event are ingested concurrently; Bedrock calls share the
+# EMBED_MAX_WORKERS pool and Data API calls share DB_MAX_CONCURRENCY slots
+RECORD_MAX_WORKERS = int(os.environ.get("RECORD_MAX_WORKERS", "4"))
+DB_MAX_CONCURRENCY = int(os.environ.get("DB_MAX_CONCURRENCY", "4"))
+
+# Embedding model + seen-content cache (skips Bedrock and the insert for known rows).
+# The model actually used is the active one in kalshi_embedding_models (see
+# embedding_models.py), re-read every EMBED_MODEL_REGISTRY_TTL seconds so a
+# cutover needs no redeploy; EMBED_MODEL_ID / EMBED_DIMENSION are the fallback
+# before the registry exists and keep scoping the seen-content hashes.
+EMBED_MODEL_ID = os.environ.get("EMBED_MODEL_ID", "amazon.titan-embed-text-v2:0")
+EMBED_DIMENSION = int(os.environ.get("EMBED_DIMENSION", "1024"))
+EMBED_MODEL_REGISTRY_TTL = int(os.environ.get("EMBED_MODEL_REGISTRY_TTL", "60"))
+EMBED_CACHE_ENABLED = os.environ.get("EMBED_CACHE_ENABLED", "true").lower() == "true"
+EMBED_CACHE_MAX_ROWS = int(os.environ.get("EMBED_CACHE_MAX_ROWS", "200000"))
+
+# Streaming ingestion: rows are read, embedded and committed one window at a time
+INGEST_WINDOW_ROWS = int(os.environ.get("INGEST_WINDOW_ROWS", "200"))
+INGEST_READ_CHUNK_BYTES = int(os.environ.get("INGEST_READ_CHUNK_BYTES", str(64 * 1024)))
+# Stop starting new windows when less than this is left before the Lambda timeout
+INGEST_TIME_RESERVE_MS = int(os.environ.get("INGEST_TIME_RESERVE_MS", "60000"))
+# Re-invoke this function asynchronously to finish a file that ran out of time
+INGEST_SELF_CONTINUE = os.environ.get("INGEST_SELF_CONTINUE", "true").lower() == "true"
 
 # AWS Clients
 s3 = boto3.client("s3", region_name=os.environ.get("AWS_REGION", "ap-southeast-2"))
-bedrock = boto3.client("bedrock-runtime", region_name=os.environ.get("AWS_REGION", "ap-southeast-2"))
+bedrock = boto3.client(
+    "bedrock-runtime",
+    region_name=os.environ.get("AWS_REGION", "ap-southeast-2"),
+    # One pooled HTTPS connection per worker, otherwise urllib3 discards extras
+    config=Config(max_pool_connections=max(10, EMBED_MAX_WORKERS), retries={"max_attempts": 5, "mode": "adaptive"})
+)
 rds_data = boto3.client("rds-data", region_name=os.environ.get("AWS_REGION", "ap-southeast-2"))
+lambda_client = boto3.client("lambda", region_name=os.environ.get("AWS_REGION", "ap-southeast-2"))
 
 # Buckets
 BUCKET_BRONZE = "kalshi-bronze-anubh-001"
 
+# Value stored in kalshi_documents.source, by S3 key prefix
+SOURCE_BY_PREFIX = {"social/": "social", "kalshi/": "kalshi", "news/": "news", "metaculus/": "metaculus"}
+
 # Aurora cluster + secret
 CLUSTER_ARN = "arn:aws:rds:ap-southeast-2:647664611140:cluster:kalshi-aurora-rds"
 SECRET_ARN = "arn:aws:secretsmanager:ap-southeast-2:647664611140:secret:rds!cluster-7e004f54-e48c-406b-99e8-3a57cea73662-P4k120"
 DATABASE_NAME = "postgres"
 
-def generate_embedding(text: str):
-    """Call Bedrock Titan to generate embeddings"""
+class StaleEmbeddingModel(Exception):
+    """The registry's active model changed after these rows were embedded.
+
+    inserted is how many rows insert_documents had already committed.
+    """
+    inserted = 0
+
+def _embedding_request(model_id, text, dimension):
+    if model_id.startswith("cohere.embed"):
+        return {"texts": [text], "input_type": "search_document", "truncate": "END"}
+    if "titan-embed-text-v2" in model_id:
+        return {"inputText": text, "dimensions": dimension}
+    return {"inputText": text}
+
+def generate_embedding(text: str, model=None):
+    """Call Bedrock to embed text with model (model_id, dimension), default the active one"""
+    model_id, dimension = model or active_embedding_model()
     print(f"🧠 Generating embedding for: {text[:50]}...")
     response = bedrock.invoke_model(
-        modelId="amazon.titan-embed-text-v2:0",
-        body=json.dumps({"inputText": text}),
+        modelId=model_id,
+        body=json.dumps(_embedding_request(model_id, text, dimension)),
         contentType="application/json",
         accept="application/json"
     )
-    embedding = json.loads(response["body"].read()).get("embedding", [])
+    payload = json.loads(response["body"].read())
+    embedding = payload["embeddings"][0] if "embeddings" in payload else payload.get("embedding", [])
+    if len(embedding) != dimension:
+        raise ValueError(f"{model_id} returned {len(embedding)} dimensions, expected {dimension}")
     print(f"✅ Embedding generated: {len(embedding)} dimensions")
     return embedding
 
-def insert_document(text, question, date, embedding):
+# Shared across all records being ingested by this container
+_db_slots = threading.BoundedSemaphore(DB_MAX_CONCURRENCY)
+_schema_lock = threading.Lock()
+_model_lock = threading.Lock()
+
+def _execute(sql, parameters=None, **kwargs):
+    def run():
+        return rds_data.execute_statement(
+            resourceArn=CLUSTER_ARN,
+            secretArn=SECRET_ARN,
+            database=DATABASE_NAME,
+            sql=sql,
+            parameters=parameters or [],
+            **kwargs
+        )
+    # Statements inside a transaction run under the slot the transaction already holds
+    if "transactionId" in kwargs:
+        return run()
+    with _db_slots:
+        return run()
+
+ACTIVE_MODEL_SQL = "SELECT model_id, dimension FROM kalshi_embedding_models WHERE status = 'active'"
+# (model_id, dimension, from_registry, expires_at)
+_active_model = (EMBED_MODEL_ID, EMBED_DIMENSION, False, 0.0)
+
+def active_embedding_model(refresh=False):
+    """(model_id, dimension) whose vectors belong in kalshi_documents.embedding"""
+    global _active_model
+    with _model_lock:
+        if not refresh and time.monotonic() < _active_model[3]:
+            return _active_model[:2]
+        try:
+            records = _execute(ACTIVE_MODEL_SQL).get("records", [])
+        except rds_data.exceptions.BadRequestException:
+            # Registry not created yet (migration 005_embedding_model_registry)
+            records = []
+        if records:
+            _active_model = (records[0][0]["stringValue"], records[0][1]["longValue"], True,
+                             time.monotonic() + EMBED_MODEL_REGISTRY_TTL)
+        else:
+            _active_model = (EMBED_MODEL_ID, EMBED_DIMENSION, False, time.monotonic() + EMBED_MODEL_REGISTRY_TTL)
+        return _active_model[:2]
+
+def content_hash(text, model_id=None):
+    """SHA-256 of the NFKC/whitespace-normalized text, scoped to the embedding model"""
+    normalized = " ".join(unicodedata.normalize("NFKC", text).split())
+    return hashlib.sha256(f"{model_id or EMBED_MODEL_ID}\n{normalized}".encode("utf-8")).hexdigest()
+
+_cache_table_ready = False
+
+def _ensure_cache_table():
+    """Create the cache table once per container"""
+    global _cache_table_ready
+    with _schema_lock:
+        if _cache_table_ready:
+            return
+        _execute("""
+            CREATE TABLE IF NOT EXISTS kalshi_embedding_cache (
+                content_hash CHAR(64) PRIMARY KEY,
+                model_id VARCHAR(100) NOT NULL,
+                last_seen_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        _execute("""
+            CREATE INDEX IF NOT EXISTS kalshi_embedding_cache_seen_idx
+            ON kalshi_embedding_cache (last_seen_at)
+        """)
+        _cache_table_ready = True
+
+def lookup_cached(hashes):
+    """Return the subset of hashes already embedded and stored, refreshing their recency"""
+    if not EMBED_CACHE_ENABLED or not hashes:
+        return set()
+    _ensure_cache_table()
+    # Data API has no array parameters, so pass the hex digests as one CSV string
+    response = _execute(
+        """
+        UPDATE kalshi_embedding_cache SET last_seen_at = CURRENT_TIMESTAMP
+        WHERE content_hash = ANY(string_to_array(:hashes, ','))
+        RETURNING content_hash
+        """,
+        [{"name": "hashes", "value": {"stringValue": ",".join(hashes)}}]
+    )
+    return {record[0]["stringValue"] for record in response.get("records", [])}
+
+def evict_cache(max_rows=None):
+    """Keep only the most recently seen max_rows cache entries"""
+    if not EMBED_CACHE_ENABLED:
+        return 0
+    response = _execute(
+        """
+        DELETE FROM kalshi_embedding_cache WHERE content_hash IN (
+            SELECT content_hash FROM kalshi_embedding_cache
+            ORDER BY last_seen_at DESC OFFSET :max_rows
+        )
+        """,
+        [{"name": "max_rows", "value": {"longValue": max_rows or EMBED_CACHE_MAX_ROWS}}]
+    )
+    evicted = response.get("numberOfRecordsUpdated", 0)
+    if evicted:
+        print(f"🧹 Evicted {evicted} embedding cache entries")
+    return evicted
+
+CACHE_INSERT_SQL = """
+    INSERT INTO kalshi_embedding_cache (content_hash, model_id)
+    VALUES (:content_hash, :model_id)
+    ON CONFLICT (content_hash) DO UPDATE SET last_seen_at = CURRENT_TIMESTAMP
+"""
+
+# A row stored before (e.g. its cache entry was evicted) would violate unique_document and fail the chunk
+INSERT_SQL = """
+    INSERT INTO kalshi_documents (text, topic, date, embedding, source, embedding_model)
+    VALUES (:text, :topic, CAST(:date AS timestamp), CAST(:embedding AS vector), :source, :embedding_model)
+    ON CONFLICT (text, topic, date) DO NOTHING
+"""
+
+def source_for_key(key):
+    return next((source for prefix, source in SOURCE_BY_PREFIX.items() if key.startswith(prefix)), "kalshi")
+
+def _document_parameters(text, question, date, embedding, source="kalshi", model_id=None):
+    return [
+        {"name": "text", "value": {"stringValue": text}},
+        {"name": "topic", "value": {"stringValue": question}},
+        {"name": "date", "value": {"stringValue": date}},
+        # pgvector text literal, e.g. [0.1,0.2,...]
+        {"name": "embedding", "value": {"stringValue": json.dumps(embedding, separators=(",", ":"))}},
+        {"name": "source", "value": {"stringValue": source}},
+        {"name": "embedding_model", "value": {"stringValue": model_id or EMBED_MODEL_ID}}
+    ]
+
+def insert_document(text, question, date, embedding, source="kalshi", model_id=None):
     """Insert a single record into Aurora via Data API"""
     print(f"💾 Inserting to RDS: {question[:30]}...")
-    sql = """
-        INSERT INTO kalshi_documents (text, topic, date, embedding)
-        VALUES (:text, :topic, :date, :embedding::jsonb)
-    """
     rds_data.execute_statement(
         resourceArn=CLUSTER_ARN,
         secretArn=SECRET_ARN,
         database=DATABASE_NAME,
-        sql=sql,
-        parameters=[
-            {"name": "text", "value": {"stringValue": text}},
-            {"name": "topic", "value": {"stringValue": question}},
-            {"name": "date", "value": {"stringValue": date}},
-            {"name": "embedding", "value": {"stringValue": json.dumps(embedding)}}
-        ]
+        sql=INSERT_SQL,
+        parameters=_document_parameters(text, question, date, embedding, source,
+                                        model_id or active_embedding_model()[0])
     )
     print("✅ RDS insert successful")
 
+def _insert_chunk(parameter_sets, cache_parameter_sets=None, extra_statements=(), model_id=None):
+    """Write one chunk under a shared DB slot (see _write_chunk)"""
+    with _db_slots:
+        _write_chunk(parameter_sets, cache_parameter_sets, extra_statements, model_id)
+
+def _write_chunk(parameter_sets, cache_parameter_sets=None, extra_statements=(), model_id=None):
+    """Write one chunk with batch_execute_statement inside its own transaction.
+
+    Cache entries (and any extra (sql, parameters) statements, e.g. the
+    ingestion checkpoint) commit in the same transaction as their documents,
+    so a row is only ever marked as seen once it is actually stored. With
+    model_id, the chunk is rolled back (StaleEmbeddingModel) if that model
+    is no longer the active one; insert_documents checks again when the
+    insert itself fails.
+    """
+    tx = rds_data.begin_transaction(
+        resourceArn=CLUSTER_ARN, secretArn=SECRET_ARN, database=DATABASE_NAME
+    )
+    try:
+        rds_data.batch_execute_statement(
+            resourceArn=CLUSTER_ARN,
+            secretArn=SECRET_ARN,
+            database=DATABASE_NAME,
+            sql=INSERT_SQL,
+            parameterSets=parameter_sets,
+            transactionId=tx["transactionId"]
+        )
+        if model_id is not None:
+            # The insert queued behind any cutover in progress, so this sees the model active now
+            records = _execute(ACTIVE_MODEL_SQL, transactionId=tx["transactionId"]).get("records", [])
+            if records and records[0][0]["stringValue"] != model_id:
+                raise StaleEmbeddingModel(f"{model_id} was replaced by {records[0][0]['stringValue']}")
+        if cache_parameter_sets:
+            rds_data.batch_execute_statement(
+                resourceArn=CLUSTER_ARN,
+                secretArn=SECRET_ARN,
+                database=DATABASE_NAME,
+                sql=CACHE_INSERT_SQL,
+                parameterSets=cache_parameter_sets,
+                transactionId=tx["transactionId"]
+            )
+        for sql, parameters in extra_statements:
+            _execute(sql, parameters, transactionId=tx["transactionId"])
+        rds_data.commit_transaction(
+            resourceArn=CLUSTER_ARN, secretArn=SECRET_ARN, transactionId=tx["transactionId"]
+        )
+    except Exception:
+        try:
+            rds_data.rollback_transaction(
+                resourceArn=CLUSTER_ARN, secretArn=SECRET_ARN, transactionId=tx["transactionId"]
+            )
+        except Exception as rollback_error:
+            print(f"⚠️ Rollback failed: {rollback_error}")
+        raise
+
+def insert_documents(documents, embeddings, content_hashes=None, batch_size=None, final_statements=(), source="kalshi",
+                     model_id=None):
+    """Bulk insert (text, topic, date) documents, committing once per chunk.
+
+    Only chunks that fail are retried, with exponential backoff. Returns the
+    number of rows committed; raises if a chunk still fails after retries.
+    final_statements run inside the last chunk's transaction (or on their
+    own when there is nothing to insert). embeddings are from model_id
+    (default the active model); StaleEmbeddingModel is raised without
+    retrying if a cutover replaced it.
+    """
+    batch_size = batch_size or INSERT_BATCH_SIZE
+    model_id = model_id or active_embedding_model()[0]
+    # Without a registry there is nothing to cut over, so nothing to check
+    check_model = model_id if _active_model[2] else None
+    parameter_sets = [
+        _document_parameters(text, topic, date, embedding, source, model_id)
+        for (text, topic, date), embedding in zip(documents, embeddings)
+    ]
+    cache_parameter_sets = None
+    if EMBED_CACHE_ENABLED and content_hashes:
+        cache_parameter_sets = [
+            [
+                {"name": "content_hash", "value": {"stringValue": h}},
+                {"name": "model_id", "value": {"stringValue": model_id}}
+            ]
+            for h in content_hashes
+        ]
+
+    if not parameter_sets:
+        for sql, parameters in final_statements:
+            _execute(sql, parameters)
+        return 0
+
+    inserted = 0
+    for start in range(0, len(parameter_sets), batch_size):
+        chunk = parameter_sets[start:start + batch_size]
+        cache_chunk = cache_parameter_sets[start:start + batch_size] if cache_parameter_sets else None
+        is_last = start + batch_size >= len(parameter_sets)
+        for attempt in range(1, INSERT_MAX_RETRIES + 1):
+            try:
+                _insert_chunk(chunk, cache_chunk, final_statements if is_last else (), check_model)
+                break
+            except StaleEmbeddingModel as e:
+                e.inserted = inserted
+                raise
+            except Exception as e:
+                # A cutover to another dimension fails the insert itself, before _write_chunk's check
+                if check_model and active_embedding_model(refresh=True)[0] != check_model:
+                    stale = StaleEmbeddingModel(f"{check_model} was replaced by {active_embedding_model()[0]}")
+                    stale.inserted = inserted
+                    raise stale from e
+                if attempt == INSERT_MAX_RETRIES:
+                    raise RuntimeError(
+                        f"Chunk at row {start} failed after {attempt} attempts ({inserted} rows committed): {e}"
+                    ) from e
+                print(f"⚠️ Chunk at row {start} failed (attempt {attempt}): {e}")
+                time.sleep(2 ** (attempt - 1))
+        inserted += len(chunk)
+        print(f"💾 Inserted chunk of {len(chunk)} rows ({inserted}/{len(parameter_sets)})")
+    return inserted
 
+# Created once per container so warm invocations reuse the worker threads
+_embed_pool = ThreadPoolExecutor(max_workers=EMBED_MAX_WORKERS)
+
+def generate_embeddings(texts, model=None):
+    """Embed texts in batches through the bounded worker pool, preserving input order"""
+    model = model or active_embedding_model()
+    embeddings = []
+    for start in range(0, len(texts), EMBED_BATCH_SIZE):
+        batch = texts[start:start + EMBED_BATCH_SIZE]
+        # map() yields results in submission order regardless of completion order
+        embeddings.extend(_embed_pool.map(lambda text: generate_embedding(text, model), batch))
+        print(f"🧠 Embedded batch {start // EMBED_BATCH_SIZE + 1}: {len(embeddings)}/{len(texts)} rows")
+    return embeddings
+
+def filter_seen_documents(documents):
+    """Drop documents whose content was already embedded (in the cache or earlier in this batch)"""
+    hashes = [content_hash(text) for text, _, _ in documents]
+    cached = lookup_cached(sorted(set(hashes)))
+
+    fresh_documents, fresh_hashes = [], []
+    seen = set(cached)
+    for document, h in zip(documents, hashes):
+        if h in seen:
+            continue
+        seen.add(h)
+        fresh_documents.append(document)
+        fresh_hashes.append(h)
+
+    skipped = len(documents) - len(fresh_documents)
+    if skipped:
+        print(f"♻️ Skipping {skipped} already-embedded rows ({len(fresh_documents)} new)")
+    return fresh_documents, fresh_hashes, skipped
+
+_checkpoint_table_ready = False
+
+def _ensure_checkpoint_table():
+    global _checkpoint_table_ready
+    with _schema_lock:
+        if _checkpoint_table_ready:
+            return
+        _execute("""
+            CREATE TABLE IF NOT EXISTS kalshi_ingest_checkpoints (
+                s3_key TEXT PRIMARY KEY,
+                etag VARCHAR(100) NOT NULL,
+                rows_done INTEGER NOT NULL DEFAULT 0,
+                completed BOOLEAN NOT NULL DEFAULT FALSE,
+                updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        _checkpoint_table_ready = True
+
+def load_checkpoint(key, etag):
+    """Return (rows_done, completed) for this exact object version, or (0, False)"""
+    _ensure_checkpoint_table()
+    response = _execute(
+        "SELECT rows_done, completed FROM kalshi_ingest_checkpoints WHERE s3_key = :key AND etag = :etag",
+        [
+            {"name": "key", "value": {"stringValue": key}},
+            {"name": "etag", "value": {"stringValue": etag}}
+        ]
+    )
+    records = response.get("records", [])
+    if not records:
+        return 0, False
+    return records[0][0]["longValue"], records[0][1]["booleanValue"]
+
+def checkpoint_statement(key, etag, rows_done, completed=False):
+    """Upsert for the checkpoint row, meant to commit alongside the rows it covers"""
+    return (
+        """
+        INSERT INTO kalshi_ingest_checkpoints (s3_key, etag, rows_done, completed)
+        VALUES (:key, :etag, :rows_done, :completed)
+        ON CONFLICT (s3_key) DO UPDATE SET
+            etag = EXCLUDED.etag, rows_done = EXCLUDED.rows_done,
+            completed = EXCLUDED.completed, updated_at = CURRENT_TIMESTAMP
+        """,
+        [
+            {"name": "key", "value": {"stringValue": key}},
+            {"name": "etag", "value": {"stringValue": etag}},
+            {"name": "rows_done", "value": {"longValue": rows_done}},
+            {"name": "completed", "value": {"booleanValue": completed}}
+        ]
+    )
+
+def iter_lines(body, chunk_size=None):
+    """Decode an S3 StreamingBody chunk by chunk and yield lines with their newline"""
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    pending = ""
+    for chunk in body.iter_chunks(chunk_size or INGEST_READ_CHUNK_BYTES):
+        pending += decoder.decode(chunk)
+        lines = pending.split("\n")
+        pending = lines.pop()
+        for line in lines:
+            yield line + "\n"
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending
+
+def parse_social_row(item):
+    """Map a social/ CSV row to a (text, topic, date) document, or None to skip it"""
+    post_text = (item.get("context") or "").strip()
+    topic_raw = (item.get("topic") or "").strip()
+    if not (post_text and topic_raw):
+        return None
+
+    # date is the partition key, so it must always be a valid timestamp
+    date_raw = (item.get('datetime') or '').strip()
+    try:
+        if '/' in date_raw:
+            dt = datetime.strptime(date_raw, '%d/%m/%Y %H:%M')
+        else:
+            dt = datetime.fromisoformat(date_raw)
+    except ValueError:
+        dt = datetime.utcnow()
+    date = dt.strftime('%Y-%m-%d %H:%M')
+    return post_text, f"{topic_raw} social sentiment", date
+
+def iter_documents(key, body):
+    """Yield one parsed document (or None) per source row of the object, streaming"""
+    if key.startswith("kalshi/"):
+        # Imported lazily so social-only invocations don't pay the pandas cold start
+        from kalshi_features import iter_kalshi_documents
+        # Per-option window summaries replace the raw points; "rows" are summaries here
+        yield from iter_kalshi_documents(body)
+        return
+
+    # csv handles quoted fields that span lines because each line keeps its newline
+    for item in csv.DictReader(iter_lines(body)):
+        if key.startswith("social/"):
+            yield parse_social_row(item)
+        else:
+            yield None
+
+def _windows(rows, size):
+    window = []
+    for row in rows:
+        window.append(row)
+        if len(window) >= size:
+            yield window
+            window = []
+    if window:
+        yield window
+
+def _out_of_time(context):
+    if context is None or not hasattr(context, "get_remaining_time_in_millis"):
+        return False
+    return context.get_remaining_time_in_millis() < INGEST_TIME_RESERVE_MS
+
+def _continue_async(context, key):
+    """Hand the rest of the file to a fresh invocation, which resumes from the checkpoint"""
+    if not INGEST_SELF_CONTINUE or context is None:
+        return False
+    lambda_client.invoke(
+        FunctionName=context.invoked_function_arn,
+        InvocationType="Event",
+        # The handler unquotes keys like S3 notifications, so send it quoted
+        Payload=json.dumps({"file": urllib.parse.quote_plus(key)}).encode("utf-8")
+    )
+    return True
+
+def ingest_object(key, context=None):
+    """Stream one S3 object into kalshi_documents, resuming from its checkpoint"""
+    obj = s3.get_object(Bucket=BUCKET_BRONZE, Key=key)
+    etag = obj["ETag"].strip('"')
+
+    rows_done, completed = load_checkpoint(key, etag)
+    if completed:
+        print(f"⏭️ {key} ({etag}) already ingested")
+        return {"status": "success", "file": key, "processed": 0, "skipped_cached": 0, "rows": rows_done}
+    if rows_done:
+        print(f"⏯️ Resuming {key} from row {rows_done}")
+
+    processed = skipped = 0
+    # Rows before the checkpoint are parsed but never embedded or inserted again
+    rows = itertools.islice(iter_documents(key, obj["Body"]), rows_done, None)
+
+    for window in _windows(rows, INGEST_WINDOW_ROWS):
+        if _out_of_time(context):
+            obj["Body"].close()
+            continued = _continue_async(context, key)
+            print(f"⏱️ Stopping at row {rows_done} before timeout (continued={continued})")
+            return {"status": "partial", "file": key, "processed": processed,
+                    "skipped_cached": skipped, "rows": rows_done, "continued": continued}
+
+        documents = [document for document in window if document]
+        documents, hashes, window_skipped = filter_seen_documents(documents)
+
+        rows_done += len(window)
+        for refresh in (False, True):
+            # One model per window; if a cutover lands mid-window, the uncommitted rest is re-embedded
+            model = active_embedding_model(refresh=refresh)
+            embeddings = generate_embeddings([text for text, _, _ in documents], model)
+            try:
+                processed += insert_documents(
+                    documents, embeddings, hashes,
+                    final_statements=[checkpoint_statement(key, etag, rows_done)],
+                    source=source_for_key(key), model_id=model[0]
+                )
+                break
+            except StaleEmbeddingModel as e:
+                if refresh:
+                    raise
+                print(f"🔀 {e}; re-embedding the {len(documents) - e.inserted} uncommitted rows")
+                processed += e.inserted
+                documents, hashes = documents[e.inserted:], hashes[e.inserted:]
+        skipped += window_skipped
+        print(f"📊 {key}: {rows_done} rows read, {processed} inserted")
+
+    _execute(*checkpoint_statement(key, etag, rows_done, completed=True))
+    if processed:
+        evict_cache()
+    return {"status": "success", "file": key, "processed": processed, "skipped_cached": skipped, "rows": rows_done}
 
 import urllib.parse
 
+# Record-level fan-out; nested Bedrock/DB work goes through the shared pools above
+_record_pool = ThreadPoolExecutor(max_workers=RECORD_MAX_WORKERS)
+
+def extract_records(event):
+    """Flatten a manual, S3 or SQS(-wrapped S3) event into (message_id, key) pairs"""
+    if event.get("file"):
+        return [(None, event["file"])]
+
+    records = []
+    for record in event.get("Records", []):
+        if record.get("eventSource") == "aws:sqs":
+            body = json.loads(record["body"])
+            # s3:TestEvent and other non-object notifications carry no Records
+            for inner in body.get("Records", []):
+                if "s3" in inner:
+                    records.append((record["messageId"], inner["s3"]["object"]["key"]))
+        elif "s3" in record:
+            records.append((None, record["s3"]["object"]["key"]))
+    return records
+
+def _ingest_record(key, context):
+    # URL decode the key to handle spaces
+    decoded_key = urllib.parse.unquote_plus(key)
+    print(f"📁 Processing file: {decoded_key}")
+    try:
+        return ingest_object(decoded_key, context)
+    except Exception as e:
+        print(f"❌ Error on {decoded_key}: {str(e)}")
+        return {"status": "error", "file": decoded_key, "error": str(e)}
+
 def lambda_handler(event, context):
     try:
-        key = event.get("file") or event["Records"][0]["s3"]["object"]["key"]
-        
-        # URL decode the key to handle spaces
-        decoded_key = urllib.parse.unquote_plus(key)
-        print(f"📁 Processing file: {decoded_key}")
-        
-        obj = s3.get_object(Bucket=BUCKET_BRONZE, Key=decoded_key)
-        content = obj["Body"].read().decode("utf-8")
-        data = list(csv.DictReader(StringIO(content)))
-        print(f"📊 CSV rows found: {len(data)}")
-
-        processed = 0
-        for item in data:
-            text = None
-            
-            if decoded_key.startswith("social/"):
-                context = item.get("context", "").strip()
-                topic_raw = item.get("topic", "").strip()
-                if context and topic_raw:
-                    text = context
-                    topic = f"{topic_raw} social sentiment"
-                    date_raw = item.get('datetime', '')
-                    try:
-                        if '/' in date_raw:
-                            dt = datetime.strptime(date_raw, '%d/%m/%Y %H:%M')
-                            date = dt.strftime('%Y-%m-%d %H:%M')
-                        else:
-                            date = date_raw
-                    except:
-                        date = datetime.utcnow().strftime('%Y-%m-%d %H:%M')
-            
-            if text:
-                embedding = generate_embedding(text)
-                insert_document(text, topic, date, embedding)
-                processed += 1
-
-        return {"status": "success", "processed": processed}
+        records = extract_records(event)
+        futures = [(message_id, _record_pool.submit(_ingest_record, key, context)) for message_id, key in records]
+        results = [(message_id, future.result()) for message_id, future in futures]
     except Exception as e:
         print(f"❌ Error: {str(e)}")
         return {"status": "error", "error": str(e)}
+
+    failed_messages = []
+    for message_id, result in results:
+        # A partial file that was not handed to a continuation must be redelivered
+        failed = result["status"] == "error" or (result["status"] == "partial" and not result.get("continued"))
+        if failed and message_id and message_id not in failed_messages:
+            failed_messages.append(message_id)
+
+    errors = sum(1 for _, result in results if result["status"] == "error")
+    if not errors:
+        status = "success"
+    elif errors == len(results):
+        status = "error"
+    else:
+        status = "partial_failure"
+    response = {
+        "status": status,
+        "processed": sum(result.get("processed", 0) for _, result in results),
+        "results": [result for _, result in results]
+    }
+    if any(message_id for message_id, _ in records):
+        # SQS partial batch response: only the failed messages are retried
+        response["batchItemFailures"] = [{"itemIdentifier": message_id} for message_id in failed_messages]
+    return response
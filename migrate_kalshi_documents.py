@@ -0,0 +1,366 @@
+import argparse
+import boto3
+import json
+import os
+import psycopg2
+from datetime import date, datetime
+
+from embedding_models import create_registry
+from vector_index import QUANTIZATIONS, VectorIndexManager, ivfflat_lists
+
+# Aurora connection (same cluster/secret as the Lambda and RAG notebook)
+RDS_HOST = os.environ.get("RDS_HOST", "kalshi-aurora-rds-instance-1.cr4oq4mee56z.ap-southeast-2.rds.amazonaws.com")
+RDS_DATABASE = os.environ.get("RDS_DATABASE", "postgres")
+RDS_USERNAME = os.environ.get("RDS_USERNAME", "postgres")
+RDS_SECRET_ARN = os.environ.get(
+    "RDS_SECRET_ARN",
+    "arn:aws:secretsmanager:ap-southeast-2:647664611140:secret:rds!cluster-7e004f54-e48c-406b-99e8-3a57cea73662-P4k120"
+)
+AWS_REGION = os.environ.get("AWS_REGION", "ap-southeast-2")
+
+EMBEDDING_DIM = 1024
+# Monthly partitions are kept this far ahead of the current month
+PARTITION_MONTHS_AHEAD = int(os.environ.get("PARTITION_MONTHS_AHEAD", "3"))
+
+
+def get_connection():
+    secrets_client = boto3.client('secretsmanager', region_name=AWS_REGION)
+    secret = json.loads(secrets_client.get_secret_value(SecretId=RDS_SECRET_ARN)['SecretString'])
+    return psycopg2.connect(
+        host=RDS_HOST, database=RDS_DATABASE, user=RDS_USERNAME,
+        password=secret['password'], port=5432, sslmode='require'
+    )
+
+
+def _column_type(cur, table, column):
+    cur.execute("""
+        SELECT udt_name FROM information_schema.columns
+        WHERE table_name = %s AND column_name = %s
+    """, (table, column))
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+def migrate_embedding_to_vector(cur):
+    """Convert kalshi_documents.embedding from JSONB to native vector(1024) and index it"""
+    cur.execute("CREATE EXTENSION IF NOT EXISTS vector;")
+
+    if _column_type(cur, "kalshi_documents", "embedding") == "jsonb":
+        # Rows with a missing or wrongly sized embedding become NULL instead of failing the cast
+        cur.execute(f"""
+            ALTER TABLE kalshi_documents
+            ALTER COLUMN embedding TYPE vector({EMBEDDING_DIM})
+            USING CASE
+                WHEN jsonb_typeof(embedding) = 'array'
+                 AND jsonb_array_length(embedding) = {EMBEDDING_DIM}
+                THEN (embedding::text)::vector({EMBEDDING_DIM})
+            END
+        """)
+        print("✅ embedding column converted to vector")
+
+    cur.execute("SELECT COUNT(*) FROM kalshi_documents WHERE embedding IS NOT NULL;")
+    row_count = cur.fetchone()[0]
+
+    # Rebuild so the ivfflat centroids are trained on the converted data
+    cur.execute("DROP INDEX IF EXISTS kalshi_embedding_idx;")
+    cur.execute(f"""
+        CREATE INDEX kalshi_embedding_idx
+        ON kalshi_documents USING ivfflat (embedding vector_cosine_ops)
+        WITH (lists = {ivfflat_lists(row_count)});
+    """)
+    cur.execute("ANALYZE kalshi_documents;")
+    print(f"✅ kalshi_embedding_idx built over {row_count} vectors")
+
+
+def add_source_column(cur):
+    """Add an indexed source column (kalshi/social/news/metaculus) and backfill it from topic"""
+    cur.execute("ALTER TABLE kalshi_documents ADD COLUMN IF NOT EXISTS source VARCHAR(100);")
+    cur.execute("""
+        UPDATE kalshi_documents
+        SET source = CASE WHEN topic LIKE '%social sentiment' THEN 'social' ELSE 'kalshi' END
+        WHERE source IS NULL;
+    """)
+    cur.execute("ALTER TABLE kalshi_documents ALTER COLUMN source SET DEFAULT 'kalshi';")
+    cur.execute("CREATE INDEX IF NOT EXISTS kalshi_documents_source_idx ON kalshi_documents (source);")
+    cur.execute("ANALYZE kalshi_documents;")
+    print("✅ source column added and backfilled")
+
+
+def add_full_text_search(cur):
+    """Generated tsvector over topic (weight A) and text (weight B) with a GIN index"""
+    cur.execute("""
+        ALTER TABLE kalshi_documents ADD COLUMN IF NOT EXISTS text_search tsvector
+        GENERATED ALWAYS AS (
+            setweight(to_tsvector('english', coalesce(topic, '')), 'A') ||
+            setweight(to_tsvector('english', coalesce(text, '')), 'B')
+        ) STORED;
+    """)
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS kalshi_documents_text_search_idx
+        ON kalshi_documents USING gin (text_search);
+    """)
+    cur.execute("ANALYZE kalshi_documents;")
+    print("✅ text_search column and GIN index created")
+
+
+def _month_start(value, offset=0):
+    month = value.year * 12 + value.month - 1 + offset
+    return date(month // 12, month % 12 + 1, 1)
+
+
+def partition_name(month):
+    return f"kalshi_documents_{month:%Y_%m}"
+
+
+def _is_partitioned(cur, table):
+    cur.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", (table,))
+    row = cur.fetchone()
+    return bool(row) and row[0] == 'p'
+
+
+def _insertable_columns(cur, table):
+    cur.execute("""
+        SELECT column_name FROM information_schema.columns
+        WHERE table_name = %s AND is_generated = 'NEVER'
+        ORDER BY ordinal_position
+    """, (table,))
+    return [row[0] for row in cur.fetchall()]
+
+
+def _create_partition(cur, month, following):
+    """Create one monthly partition, first moving any of its rows out of DEFAULT.
+
+    Postgres refuses to add a partition whose range the DEFAULT partition
+    already holds rows for (e.g. after the scheduled run lapsed), so those
+    rows are moved into a standalone table that is then attached.
+    """
+    name = partition_name(month)
+    cur.execute("""
+        SELECT EXISTS (SELECT 1 FROM kalshi_documents_default WHERE date >= %s AND date < %s)
+    """, (month, following))
+    if not cur.fetchone()[0]:
+        # Indexes declared on the parent are created on the new partition automatically
+        cur.execute(f"""
+            CREATE TABLE {name} PARTITION OF kalshi_documents
+            FOR VALUES FROM ('{month}') TO ('{following}');
+        """)
+        return
+
+    columns = ", ".join(_insertable_columns(cur, "kalshi_documents"))
+    cur.execute(f"CREATE TABLE {name} (LIKE kalshi_documents INCLUDING DEFAULTS INCLUDING GENERATED);")
+    cur.execute(f"""
+        WITH moved AS (
+            DELETE FROM kalshi_documents_default WHERE date >= %s AND date < %s
+            RETURNING {columns}
+        )
+        INSERT INTO {name} ({columns}) SELECT {columns} FROM moved;
+    """, (month, following))
+    moved = cur.rowcount
+    # Builds the parent's indexes on the new partition as part of the attach
+    cur.execute(f"""
+        ALTER TABLE kalshi_documents ATTACH PARTITION {name}
+        FOR VALUES FROM ('{month}') TO ('{following}');
+    """)
+    print(f"📦 Moved {moved} rows from kalshi_documents_default into {name}")
+
+
+def ensure_partitions(cur, start=None, months_ahead=PARTITION_MONTHS_AHEAD):
+    """Create any missing monthly partitions from start (default: this month) to months_ahead"""
+    first = _month_start(start or datetime.utcnow())
+    last = _month_start(datetime.utcnow(), months_ahead)
+    month, created = first, 0
+    while month <= last:
+        following = _month_start(month, 1)
+        cur.execute("SELECT to_regclass(%s)", (partition_name(month),))
+        if cur.fetchone()[0] is None:
+            _create_partition(cur, month, following)
+            created += 1
+        month = following
+    if created:
+        print(f"✅ Created {created} monthly partition(s) up to {last:%Y-%m}")
+    return created
+
+
+def detach_partitions_older_than(cur, months):
+    """Detach monthly partitions that end more than months ago; the tables are kept, not dropped"""
+    cutoff = _month_start(datetime.utcnow(), -months)
+    cur.execute("""
+        SELECT child.relname
+        FROM pg_inherits
+        JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        WHERE parent.relname = 'kalshi_documents' AND child.relname ~ '^kalshi_documents_[0-9]{4}_[0-9]{2}$'
+        ORDER BY child.relname
+    """)
+    detached = []
+    for (name,) in cur.fetchall():
+        year, month = map(int, name.rsplit("_", 2)[1:])
+        if _month_start(date(year, month, 1), 1) <= cutoff:
+            cur.execute(f"ALTER TABLE kalshi_documents DETACH PARTITION {name};")
+            detached.append(name)
+    for name in detached:
+        print(f"📦 Detached {name}")
+    return detached
+
+
+def partition_by_date(cur):
+    """Rebuild kalshi_documents as a table range-partitioned by month on a TIMESTAMP date.
+
+    Unparseable dates go to the DEFAULT partition. The old heap is kept as
+    kalshi_documents_unpartitioned until it is dropped by hand. Works on both
+    the Lambda schema (date as text) and RDSVectorStore's (TIMESTAMP, url,
+    created_at).
+    """
+    if _is_partitioned(cur, "kalshi_documents"):
+        return
+    date_type = _column_type(cur, "kalshi_documents", "date")
+
+    cur.execute(f"""
+        CREATE TABLE kalshi_documents_part (
+            id BIGINT NOT NULL DEFAULT nextval('kalshi_documents_id_seq'),
+            text TEXT,
+            topic VARCHAR(500),
+            date TIMESTAMP NOT NULL,
+            embedding vector({EMBEDDING_DIM}),
+            source VARCHAR(100) DEFAULT 'kalshi',
+            url TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            text_search tsvector GENERATED ALWAYS AS (
+                setweight(to_tsvector('english', coalesce(topic, '')), 'A') ||
+                setweight(to_tsvector('english', coalesce(text, '')), 'B')
+            ) STORED,
+            PRIMARY KEY (id, date)
+        ) PARTITION BY RANGE (date);
+    """)
+    cur.execute("CREATE TABLE kalshi_documents_default PARTITION OF kalshi_documents_part DEFAULT;")
+
+    # Leading "YYYY-MM-DD[ HH:MM[:SS]]" covers every format the scrapers write;
+    # anything else gets the 1970 sentinel and lands in the DEFAULT partition
+    timestamp_prefix = "^[0-9]{4}-[0-9]{2}-[0-9]{2}(?:[ T][0-9]{2}:[0-9]{2}(?::[0-9]{2})?)?"
+    if date_type in ("timestamp", "timestamptz", "date"):
+        parsed_date = "COALESCE(date::timestamp, TIMESTAMP '1970-01-01')"
+    else:
+        parsed_date = f"""
+            CASE WHEN date ~ '{timestamp_prefix}'
+                 THEN substring(date from '{timestamp_prefix}')::timestamp
+                 ELSE TIMESTAMP '1970-01-01'
+            END
+        """
+    cur.execute(f"SELECT MIN({parsed_date}) FROM kalshi_documents WHERE {parsed_date} > TIMESTAMP '1970-01-01';")
+    oldest = cur.fetchone()[0]
+
+    # Create the monthly partitions before copying so rows don't pile up in DEFAULT
+    cur.execute("ALTER TABLE kalshi_documents RENAME TO kalshi_documents_unpartitioned;")
+    cur.execute("ALTER TABLE kalshi_documents_part RENAME TO kalshi_documents;")
+    ensure_partitions(cur, start=oldest)
+
+    # Free the old table's index / constraint names for the new ones
+    for index in ("kalshi_embedding_idx", "kalshi_documents_source_idx", "kalshi_documents_text_search_idx"):
+        cur.execute(f"ALTER INDEX IF EXISTS {index} RENAME TO {index}_unpartitioned;")
+    cur.execute("""
+        SELECT 1 FROM pg_constraint
+        WHERE conname = 'unique_document' AND conrelid = 'kalshi_documents_unpartitioned'::regclass
+    """)
+    if cur.fetchone():
+        cur.execute("ALTER TABLE kalshi_documents_unpartitioned "
+                    "RENAME CONSTRAINT unique_document TO unique_document_unpartitioned;")
+    # Includes the partition key, so Postgres accepts it as a partitioned unique constraint
+    cur.execute("ALTER TABLE kalshi_documents ADD CONSTRAINT unique_document UNIQUE (text, topic, date);")
+
+    # url / created_at only exist on RDSVectorStore-created tables
+    optional = [column for column in ("url", "created_at")
+                if _column_type(cur, "kalshi_documents_unpartitioned", column)]
+    columns = ", ".join(["id", "text", "topic", "date", "embedding", "source"] + optional)
+    values = ", ".join(["id", "text", "topic", parsed_date, "embedding", "source"] + optional)
+    cur.execute(f"""
+        INSERT INTO kalshi_documents ({columns})
+        SELECT {values}
+        FROM kalshi_documents_unpartitioned
+        ON CONFLICT ON CONSTRAINT unique_document DO NOTHING;
+    """)
+    print(f"✅ Copied {cur.rowcount} rows into the partitioned table")
+    cur.execute("ALTER SEQUENCE kalshi_documents_id_seq OWNED BY kalshi_documents.id;")
+
+    # Declared on the parent: one index per partition, so every partition's
+    # ivfflat lists are trained on that month's data only
+    cur.execute("SELECT COUNT(*) FROM kalshi_documents;")
+    row_count = cur.fetchone()[0]
+    cur.execute("SELECT COUNT(*) FROM pg_inherits WHERE inhparent = 'kalshi_documents'::regclass;")
+    partitions = cur.fetchone()[0]
+    cur.execute(f"""
+        CREATE INDEX kalshi_embedding_idx
+        ON kalshi_documents USING ivfflat (embedding vector_cosine_ops)
+        WITH (lists = {ivfflat_lists(row_count // max(1, partitions))});
+    """)
+    cur.execute("CREATE INDEX kalshi_documents_source_idx ON kalshi_documents (source);")
+    cur.execute("CREATE INDEX kalshi_documents_text_search_idx ON kalshi_documents USING gin (text_search);")
+    cur.execute("ANALYZE kalshi_documents;")
+    print(f"✅ kalshi_documents partitioned by month across {partitions} partitions")
+
+
+def add_embedding_model_registry(cur):
+    """Record which model produced every embedding (see embedding_models.py for upgrades)"""
+    create_registry(cur, "kalshi_documents")
+    print("✅ kalshi_embedding_models registry and embedding_model column created")
+
+
+# Applied in order, each exactly once
+MIGRATIONS = [
+    ("001_embedding_jsonb_to_vector", migrate_embedding_to_vector),
+    ("002_source_column", add_source_column),
+    ("003_full_text_search", add_full_text_search),
+    ("004_partition_by_date", partition_by_date),
+    ("005_embedding_model_registry", add_embedding_model_registry),
+]
+
+
+def run_migrations(conn):
+    """Apply pending migrations, each in its own transaction"""
+    with conn.cursor() as cur:
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS kalshi_schema_migrations (
+                name VARCHAR(200) PRIMARY KEY,
+                applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+            );
+        """)
+        cur.execute("SELECT name FROM kalshi_schema_migrations;")
+        applied = {row[0] for row in cur.fetchall()}
+    conn.commit()
+
+    for name, migration in MIGRATIONS:
+        if name in applied:
+            continue
+        print(f"🔧 Applying {name}...")
+        try:
+            with conn.cursor() as cur:
+                migration(cur)
+                cur.execute("INSERT INTO kalshi_schema_migrations (name) VALUES (%s);", (name,))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    print("✅ Schema up to date")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Apply kalshi_documents schema migrations")
+    parser.add_argument("--detach-older-than-months", type=int,
+                        help="also detach monthly partitions older than this many months")
+    parser.add_argument("--quantized-index", choices=sorted(QUANTIZATIONS),
+                        help="also build an HNSW index over the halfvec / binary-quantized embedding")
+    args = parser.parse_args()
+
+    connection = get_connection()
+    try:
+        run_migrations(connection)
+        # Safe to run on a schedule: keeps future months created ahead of the data
+        with connection.cursor() as cursor:
+            if _is_partitioned(cursor, "kalshi_documents"):
+                ensure_partitions(cursor)
+                if args.detach_older_than_months:
+                    detach_partitions_older_than(cursor, args.detach_older_than_months)
+        connection.commit()
+        if args.quantized_index:
+            VectorIndexManager(connection).create_quantized_index(args.quantized_index)
+    finally:
+        connection.close()
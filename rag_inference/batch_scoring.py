@@ -0,0 +1,120 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import rag_inference as rag
+
+# Concurrent Claude calls and the sustained Bedrock request rate (the account quota)
+BATCH_LLM_CONCURRENCY = int(os.environ.get("BATCH_LLM_CONCURRENCY", "8"))
+BATCH_LLM_REQUESTS_PER_MINUTE = float(os.environ.get("BATCH_LLM_REQUESTS_PER_MINUTE", "60"))
+BATCH_LLM_BURST = int(os.environ.get("BATCH_LLM_BURST", "8"))
+# Concurrent Titan calls for question embeddings
+BATCH_EMBED_SIZE = int(os.environ.get("BATCH_EMBED_SIZE", "16"))
+
+
+class TokenBucket:
+    """Async token bucket: rate tokens per second refill, up to capacity banked"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, tokens=1):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                # Holding the lock while sleeping keeps callers served in FIFO order
+                await asyncio.sleep((tokens - self._tokens) / self.rate)
+
+
+async def score_markets(questions, top_k=50, use_answer_cache=True, retrieval_mode=None,
+                        since=None, until=None, window_days=None, half_life_days=None,
+                        concurrency=None, requests_per_minute=None, burst=None, embed_batch_size=None):
+    """Run kalshi_pure_vector_rag over many questions concurrently.
+
+    Async generator yielding (index, result) pairs in completion order; a
+    failed question yields {"question": ..., "error": ...} instead of
+    stopping the sweep. Each question moves on to retrieval and Claude as
+    soon as its own embedding returns (embed_batch_size Titan calls in
+    flight), so results stream while later questions are still embedding.
+    Vector searches share the RDS connection pool and Claude calls are
+    bounded by concurrency and a requests-per-minute bucket.
+    """
+    questions = list(questions)
+    concurrency = concurrency or BATCH_LLM_CONCURRENCY
+    requests_per_minute = requests_per_minute or BATCH_LLM_REQUESTS_PER_MINUTE
+    llm_slots = asyncio.Semaphore(concurrency)
+    bucket = TokenBucket(requests_per_minute / 60.0, burst or BATCH_LLM_BURST)
+    embed_slots = asyncio.Semaphore(embed_batch_size or BATCH_EMBED_SIZE)
+
+    loop = asyncio.get_running_loop()
+    # Enough threads for every Claude call plus every pooled search to be in flight
+    executor = ThreadPoolExecutor(max_workers=concurrency + rag.RDS_POOL_MAX_SIZE + (embed_batch_size or BATCH_EMBED_SIZE))
+
+    async def score(index, question, model):
+        try:
+            async with embed_slots:
+                embedding = await loop.run_in_executor(executor, rag.generate_embedding, question, True, model)
+            if use_answer_cache:
+                watermark, settings = await loop.run_in_executor(
+                    executor, rag.answer_cache_key, retrieval_mode, since, until, window_days, half_life_days
+                )
+                cached = rag.cached_answer(question, embedding, watermark, settings)
+                if cached is not None:
+                    return index, cached
+
+            context, total_matches = await loop.run_in_executor(
+                executor, lambda: rag.retrieve_context(
+                    embedding, top_k, retrieval_mode, question,
+                    since=since, until=until, window_days=window_days, half_life_days=half_life_days,
+                    model_id=model[0]
+                )
+            )
+            prompt = rag.build_prompt(question, context)
+
+            async with llm_slots:
+                await bucket.acquire()
+                completion = await loop.run_in_executor(executor, rag.invoke_analysis, prompt)
+
+            analysis = rag.parse_analysis(completion)
+            result = rag.rag_result(question, analysis, context, total_matches)
+            if use_answer_cache and "error" not in analysis:
+                rag.get_answer_cache().store(embedding, question, result, watermark, settings)
+            return index, result
+        except Exception as e:
+            return index, {"question": question, "error": str(e)}
+
+    try:
+        print(f"📦 Scoring {len(questions)} markets ({concurrency} concurrent, {requests_per_minute:g} req/min)")
+        model = await loop.run_in_executor(executor, rag.active_embedding_model)
+        tasks = [asyncio.ensure_future(score(i, q, model)) for i, q in enumerate(questions)]
+        try:
+            for finished in asyncio.as_completed(tasks):
+                yield await finished
+        finally:
+            for task in tasks:
+                task.cancel()
+    finally:
+        executor.shutdown(wait=False)
+
+
+def score_markets_sync(questions, **kwargs):
+    """Blocking wrapper: results in input order"""
+    questions = list(questions)
+
+    async def collect():
+        results = [None] * len(questions)
+        async for index, result in score_markets(questions, **kwargs):
+            results[index] = result
+        return results
+
+    return asyncio.run(collect())
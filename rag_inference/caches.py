@@ -0,0 +1,206 @@
+import array
+import atexit
+import copy
+import os
+import pickle
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+
+
+def normalize_query(text):
+    """Case/whitespace/edge-punctuation insensitive form, so trivial rewordings share a key"""
+    text = unicodedata.normalize("NFKC", text).casefold()
+    text = " ".join(text.split())
+    return re.sub(r"^[^\w]+|[^\w]+$", "", text)
+
+
+class EmbeddingCache:
+    """Bounded LRU + TTL cache of query embeddings keyed on (model_id, normalized text).
+
+    Vectors are stored as packed float32 arrays. When path is set the cache
+    is loaded from disk on first use and written back every save_every
+    inserts and at interpreter exit, so it survives kernel restarts.
+    """
+
+    def __init__(self, max_entries=1024, ttl_seconds=86400, path=None, save_every=20):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.path = path
+        self.save_every = save_every
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (created_at, array('f'))
+        self._loaded = path is None
+        self._unsaved = 0
+        if path:
+            atexit.register(self.save)
+
+    @staticmethod
+    def key(text, model_id):
+        return f"{model_id}\n{normalize_query(text)}"
+
+    def _load(self):
+        self._loaded = True
+        try:
+            with open(self.path, "rb") as f:
+                entries = pickle.load(f)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            print(f"⚠️ Ignoring unreadable embedding cache {self.path}: {e}")
+            return
+        now = time.time()
+        for key, (created_at, vector) in entries.items():
+            if now - created_at < self.ttl_seconds:
+                self._entries[key] = (created_at, vector)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get(self, text, model_id):
+        key = self.key(text, model_id)
+        with self._lock:
+            if not self._loaded:
+                self._load()
+            entry = self._entries.get(key)
+            if entry is not None and time.time() - entry[0] < self.ttl_seconds:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1].tolist()
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, text, model_id, embedding):
+        key = self.key(text, model_id)
+        with self._lock:
+            if not self._loaded:
+                self._load()
+            self._entries[key] = (time.time(), array.array("f", embedding))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._unsaved += 1
+            flush = self.path and self._unsaved >= self.save_every
+        if flush:
+            self.save()
+
+    def save(self):
+        """Atomically write the live entries to path (no-op without a path)"""
+        if not self.path:
+            return
+        with self._lock:
+            snapshot = dict(self._entries)
+            self._unsaved = 0
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.path)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+class SemanticAnswerCache:
+    """Reuses a RAG result for a near-identical question over unchanged data.
+
+    A lookup hits when a cached query embedding is within the cosine
+    similarity threshold and was answered at the same corpus watermark with the
+    same settings key (model, retrieval mode, date window). Entries are evicted
+    oldest-first by count, dropped after max_age_seconds, and all dropped once
+    the watermark moves.
+    """
+
+    def __init__(self, threshold=0.97, max_entries=256, max_age_seconds=3600):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.max_age_seconds = max_age_seconds
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._vectors = np.empty((0, 0), dtype=np.float32)  # unit rows, aligned with _entries
+        self._entries = []  # (question, result, watermark, settings, created_at)
+
+    @staticmethod
+    def _unit(embedding):
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _retain(self, keep_entry):
+        keep = [i for i, entry in enumerate(self._entries) if keep_entry(entry)]
+        if len(keep) != len(self._entries):
+            self._entries = [self._entries[i] for i in keep]
+            self._vectors = self._vectors[keep] if keep else np.empty((0, 0), dtype=np.float32)
+
+    def _expire(self, now):
+        self._retain(lambda entry: now - entry[4] < self.max_age_seconds)
+
+    def lookup(self, embedding, watermark, settings=None):
+        """Return (result, similarity, cached_question) or None"""
+        query = self._unit(embedding)
+        with self._lock:
+            self._expire(time.time())
+            if self._entries and self._vectors.shape[1] == query.shape[0]:
+                similarities = self._vectors @ query
+                current = np.array([entry[2] == watermark and entry[3] == settings for entry in self._entries])
+                similarities[~current] = -1.0
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.threshold:
+                    self.hits += 1
+                    question, result, _, _, _ = self._entries[best]
+                    return copy.deepcopy(result), float(similarities[best]), question
+            self.misses += 1
+            return None
+
+    def store(self, embedding, question, result, watermark, settings=None):
+        vector = self._unit(embedding)
+        with self._lock:
+            now = time.time()
+            self._expire(now)
+            # Answers from an older watermark can never hit again; other settings still can
+            self._retain(lambda entry: entry[2] == watermark)
+
+            self._entries.append((question, copy.deepcopy(result), watermark, settings, now))
+            rows = vector[None, :]
+            self._vectors = np.vstack([self._vectors, rows]) if self._vectors.size else rows
+            if len(self._entries) > self.max_entries:
+                drop = len(self._entries) - self.max_entries
+                self._entries = self._entries[drop:]
+                self._vectors = self._vectors[drop:]
+
+    def clear(self):
+        with self._lock:
+            self._entries = []
+            self._vectors = np.empty((0, 0), dtype=np.float32)
+            self.hits = self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,87 @@
+import re
+import zlib
+
+import numpy as np
+
+# MinHash over word shingles; 2^31 - 1 keeps (a * h + b) inside uint64
+_MERSENNE_PRIME = (1 << 31) - 1
+_NOISE = re.compile(r"https?://\S+|^rt\s+@\w+:?|@\w+|#", re.IGNORECASE)
+_WORD = re.compile(r"\w+")
+
+
+def estimate_tokens(text):
+    """Rough Claude token count (~4 characters per token), plus one for the newline"""
+    return len(text) // 4 + 1
+
+
+def shingles(text, size=3):
+    """crc32 hashes of the word n-grams of text, ignoring URLs, mentions and RT prefixes"""
+    words = _WORD.findall(_NOISE.sub(" ", text.lower()))
+    if len(words) < size:
+        grams = [" ".join(words)]
+    else:
+        grams = [" ".join(words[i:i + size]) for i in range(len(words) - size + 1)]
+    return np.array(sorted({zlib.crc32(g.encode("utf-8")) for g in grams}), dtype=np.uint64)
+
+
+def minhash_signatures(texts, num_perm=64, seed=7):
+    """(len(texts), num_perm) MinHash signature matrix"""
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, _MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+    b = rng.integers(0, _MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+    signatures = np.empty((len(texts), num_perm), dtype=np.uint64)
+    for row, text in enumerate(texts):
+        hashes = shingles(text) % np.uint64(_MERSENNE_PRIME)
+        signatures[row] = ((hashes[:, None] * a + b) % np.uint64(_MERSENNE_PRIME)).min(axis=0)
+    return signatures
+
+
+def jaccard_matrix(signatures):
+    """Pairwise estimated Jaccard similarity from MinHash signatures"""
+    return (signatures[:, None, :] == signatures[None, :, :]).mean(axis=2)
+
+
+def select_context(results, token_budget, caps=None, dedup_threshold=0.8, diversity=0.3,
+                   line_of=lambda row: row[1]):
+    """Pick retrieved rows for the prompt by maximal marginal relevance under a token budget.
+
+    results are (source, text, topic, date, distance) rows. Relevance is
+    1 - distance; each pick is penalised by its highest MinHash similarity
+    to rows already chosen (weighted by diversity), and rows at least
+    dedup_threshold similar to a chosen row are dropped as near-duplicates.
+    caps optionally limits rows per source (unlisted sources are uncapped).
+    Returns the chosen rows in pick order and the number of near-duplicates
+    dropped.
+    """
+    if not results:
+        return [], 0
+    lines = [line_of(row) for row in results]
+    costs = np.array([estimate_tokens(line) for line in lines])
+    relevance = 1.0 - np.array([row[4] for row in results], dtype=np.float64)
+    similarity = jaccard_matrix(minhash_signatures([row[1] or "" for row in results]))
+
+    remaining = np.ones(len(results), dtype=bool)
+    closest = np.zeros(len(results))  # max similarity to anything chosen so far
+    chosen, per_source, duplicates, spent = [], {}, 0, 0
+
+    while remaining.any():
+        scores = np.where(remaining, (1.0 - diversity) * relevance - diversity * closest, -np.inf)
+        best = int(np.argmax(scores))
+        remaining[best] = False
+        source = results[best][0]
+
+        if closest[best] >= dedup_threshold:
+            duplicates += 1
+            continue
+        if caps and source in caps and per_source.get(source, 0) >= caps[source]:
+            continue
+        if spent + costs[best] > token_budget:
+            # Something shorter further down may still fit
+            continue
+
+        chosen.append(results[best])
+        per_source[source] = per_source.get(source, 0) + 1
+        spent += costs[best]
+        closest = np.maximum(closest, similarity[best])
+
+    return chosen, duplicates
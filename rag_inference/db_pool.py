@@ -0,0 +1,171 @@
+import asyncio
+import contextlib
+import threading
+import time
+from collections import deque
+
+import psycopg2
+import psycopg2.extensions
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    """Thread-safe psycopg2 connection pool with asyncio helpers.
+
+    - connections are validated on checkout (closed check, plus a SELECT 1
+      ping when they have been idle longer than validate_idle_seconds)
+    - connections older than max_age seconds are recycled
+    - if opening a connection fails authentication (e.g. the Secrets Manager
+      password was rotated), on_auth_failure() is called and the connect is
+      retried once, so callers never see the rotation
+    """
+
+    def __init__(self, connect, max_size=5, max_age=1800, validate_idle_seconds=5.0,
+                 checkout_timeout=30.0, on_auth_failure=None):
+        self._connect = connect
+        self.max_size = max_size
+        self.max_age = max_age
+        self.validate_idle_seconds = validate_idle_seconds
+        self.checkout_timeout = checkout_timeout
+        self._on_auth_failure = on_auth_failure
+
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._lock = threading.Lock()
+        self._idle = deque()  # (conn, created_at, last_used_at)
+        self._created_at = {}  # id(conn) -> created_at for checked-out connections
+        self._closed = False
+
+    # ------------------------------------------------------------------
+    # Opening / validating
+    # ------------------------------------------------------------------
+
+    def _open(self):
+        try:
+            return self._connect()
+        except psycopg2.OperationalError as e:
+            if self._on_auth_failure is None or "authentication failed" not in str(e):
+                raise
+            print("🔑 Authentication failed, refreshing credentials and retrying")
+            self._on_auth_failure()
+            return self._connect()
+
+    def _is_usable(self, conn, created_at, last_used_at):
+        if conn.closed:
+            return False
+        now = time.monotonic()
+        if now - created_at > self.max_age:
+            return False
+        if now - last_used_at > self.validate_idle_seconds:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT 1")
+                conn.rollback()
+            except psycopg2.Error:
+                return False
+        return True
+
+    @staticmethod
+    def _discard(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    # ------------------------------------------------------------------
+    # Checkout / return
+    # ------------------------------------------------------------------
+
+    def acquire(self, timeout=None):
+        """Check out a validated connection, blocking while the pool is exhausted"""
+        if self._closed:
+            raise PoolTimeout("pool is closed")
+        if not self._slots.acquire(timeout=self.checkout_timeout if timeout is None else timeout):
+            raise PoolTimeout(f"no connection available within {self.checkout_timeout}s")
+        try:
+            while True:
+                with self._lock:
+                    entry = self._idle.pop() if self._idle else None
+                if entry is None:
+                    conn, created_at = self._open(), time.monotonic()
+                    break
+                conn, created_at, last_used_at = entry
+                if self._is_usable(conn, created_at, last_used_at):
+                    break
+                self._discard(conn)
+            with self._lock:
+                self._created_at[id(conn)] = created_at
+            return conn
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def release(self, conn, discard=False):
+        """Return a connection; broken or mid-transaction connections are reset or dropped"""
+        with self._lock:
+            created_at = self._created_at.pop(id(conn), time.monotonic())
+        try:
+            if not discard and not conn.closed:
+                if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            if discard or conn.closed or self._closed or time.monotonic() - created_at > self.max_age:
+                self._discard(conn)
+            else:
+                with self._lock:
+                    self._idle.append((conn, created_at, time.monotonic()))
+        except psycopg2.Error:
+            self._discard(conn)
+        finally:
+            self._slots.release()
+
+    @contextlib.contextmanager
+    def connection(self, timeout=None):
+        conn = self.acquire(timeout)
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            self.release(conn, discard=True)
+            raise
+        except BaseException:
+            self.release(conn)
+            raise
+        else:
+            self.release(conn)
+
+    # ------------------------------------------------------------------
+    # asyncio
+    # ------------------------------------------------------------------
+
+    @contextlib.asynccontextmanager
+    async def aconnection(self, timeout=None):
+        """Async checkout; blocking pool work runs in the default executor"""
+        loop = asyncio.get_running_loop()
+        conn = await loop.run_in_executor(None, self.acquire, timeout)
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            await loop.run_in_executor(None, self.release, conn, True)
+            raise
+        except BaseException:
+            await loop.run_in_executor(None, self.release, conn)
+            raise
+        else:
+            await loop.run_in_executor(None, self.release, conn)
+
+    async def run(self, fn, *args):
+        """Run fn(conn, *args) on a pooled connection in a worker thread"""
+        loop = asyncio.get_running_loop()
+
+        def call():
+            with self.connection() as conn:
+                return fn(conn, *args)
+
+        return await loop.run_in_executor(None, call)
+
+    def close(self):
+        self._closed = True
+        with self._lock:
+            while self._idle:
+                self._discard(self._idle.pop()[0])
@@ -0,0 +1,362 @@
+"""Local read replica of the kalshi_documents vectors for in-process k-NN.
+
+Layout of the index directory (one writer, any number of readers):
+
+- vectors.bin  unit-normalised embeddings, capacity x dim, float32 or float16
+- ids.bin / dates.bin / sources.bin / lists.bin
+               int64 document id, int64 epoch seconds, uint8 source code and
+               int32 IVF list, one entry per row
+- centroids.npy  IVF centroids (spherical k-means)
+- hnsw.bin     optional hnswlib graph, when hnswlib is installed
+- state.json   row count, capacity, the id watermark and the embedding model;
+               replaced atomically last, so readers never see rows that are
+               not fully written
+
+Readers open everything with np.memmap in read-only mode, so worker
+processes on the same host share one copy through the page cache.
+
+    python local_index.py --path /mnt/kalshi-index --sync    # cron / sidecar
+"""
+import argparse
+import calendar
+import json
+import os
+import time
+from datetime import datetime
+
+import numpy as np
+
+try:
+    import hnswlib
+except ImportError:
+    hnswlib = None
+
+SOURCES = ("kalshi", "social", "news", "metaculus")
+UNKNOWN_SOURCE = 255
+# Rows re-read behind the watermark on every sync, so ids that committed out
+# of order (concurrent Lambda transactions) are still picked up
+SYNC_OVERLAP_IDS = int(os.environ.get("LOCAL_INDEX_SYNC_OVERLAP_IDS", "2000"))
+# Below this many rows an exact scan is already sub-millisecond
+IVF_MIN_ROWS = int(os.environ.get("LOCAL_INDEX_IVF_MIN_ROWS", "20000"))
+IVF_NPROBE = int(os.environ.get("LOCAL_INDEX_NPROBE", "8"))
+
+_COLUMNS = {"ids": np.int64, "dates": np.int64, "sources": np.uint8, "lists": np.int32}
+
+
+def _unit_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def _parse_vector(text):
+    return np.array(text[1:-1].split(","), dtype=np.float32)
+
+
+def _epoch(value):
+    """Seconds since 1970 for a naive UTC datetime (or ISO string)"""
+    if value is None:
+        return 0
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return calendar.timegm(value.utctimetuple())
+
+
+def spherical_kmeans(vectors, nlist, iterations=10, seed=7):
+    """Cosine k-means centroids (unit rows) for the IVF lists"""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), size=nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assign = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, vectors)
+        empty = ~np.bincount(assign, minlength=nlist).astype(bool)
+        # Re-seed empty lists from random rows
+        sums[empty] = vectors[rng.choice(len(vectors), size=int(empty.sum()))]
+        centroids = _unit_rows(sums)
+    return centroids.astype(np.float32)
+
+
+class LocalVectorIndex:
+    """Memory-mapped cosine index over kalshi_documents embeddings"""
+
+    def __init__(self, path, dim=1024, dtype="float32", readonly=True):
+        self.path = path
+        self.dim = dim
+        self.dtype = np.dtype(dtype)
+        self.readonly = readonly
+        self.count = 0
+        self.capacity = 0
+        self.watermark = 0
+        self.trained_count = 0
+        self.model = None
+        self._state_mtime = None
+        self.vectors = None
+        self.columns = {}
+        self.centroids = None
+        self._postings = None
+        self._hnsw = None
+        if not readonly:
+            os.makedirs(path, exist_ok=True)
+        self.refresh(force=True)
+
+    # ------------------------------------------------------------------
+    # Files
+    # ------------------------------------------------------------------
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def _open_maps(self):
+        mode = "r" if self.readonly else "r+"
+        if self.capacity == 0:
+            self.vectors, self.columns = None, {}
+            return
+        self.vectors = np.memmap(self._file("vectors.bin"), dtype=self.dtype, mode=mode,
+                                 shape=(self.capacity, self.dim))
+        self.columns = {name: np.memmap(self._file(f"{name}.bin"), dtype=dtype, mode=mode, shape=(self.capacity,))
+                        for name, dtype in _COLUMNS.items()}
+
+    def _grow(self, needed):
+        capacity = max(needed, 2 * self.capacity, 4096)
+        for name, itemsize in [("vectors", self.dtype.itemsize * self.dim)] + \
+                              [(name, np.dtype(dtype).itemsize) for name, dtype in _COLUMNS.items()]:
+            with open(self._file(f"{name}.bin"), "ab") as f:
+                f.truncate(capacity * itemsize)
+        self.capacity = capacity
+        self._open_maps()
+
+    def _write_state(self):
+        for array in [self.vectors, *self.columns.values()]:
+            if array is not None:
+                array.flush()
+        state = {"dim": self.dim, "dtype": self.dtype.name, "count": self.count, "capacity": self.capacity,
+                 "watermark": self.watermark, "trained_count": self.trained_count, "model": self.model}
+        tmp_path = self._file("state.json.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self._file("state.json"))
+
+    def _save_hnsw(self, graph):
+        tmp_path = self._file("hnsw.bin.tmp")
+        graph.save_index(tmp_path)
+        os.replace(tmp_path, self._file("hnsw.bin"))
+
+    def refresh(self, force=False):
+        """Pick up rows a writer has published since the last call (cheap stat when unchanged)"""
+        try:
+            mtime = os.stat(self._file("state.json")).st_mtime_ns
+        except FileNotFoundError:
+            return False
+        if not force and mtime == self._state_mtime:
+            return False
+        with open(self._file("state.json")) as f:
+            state = json.load(f)
+        self._state_mtime = mtime
+        self.dim, self.dtype = state["dim"], np.dtype(state["dtype"])
+        self.count, self.watermark = state["count"], state["watermark"]
+        self.trained_count = state["trained_count"]
+        self.model = state.get("model")
+        if state["capacity"] != self.capacity or self.vectors is None:
+            self.capacity = state["capacity"]
+            self._open_maps()
+
+        self.centroids = np.load(self._file("centroids.npy")) if os.path.exists(self._file("centroids.npy")) else None
+        if self.centroids is not None and self.count:
+            lists = np.asarray(self.columns["lists"][:self.count])
+            order = np.argsort(lists, kind="stable")
+            bounds = np.searchsorted(lists[order], np.arange(len(self.centroids) + 1))
+            self._postings = [order[bounds[i]:bounds[i + 1]] for i in range(len(self.centroids))]
+        if hnswlib is not None and os.path.exists(self._file("hnsw.bin")):
+            self._hnsw = hnswlib.Index(space="ip", dim=self.dim)
+            self._hnsw.load_index(self._file("hnsw.bin"), max_elements=self.capacity)
+        return True
+
+    # ------------------------------------------------------------------
+    # Sync from Postgres (writer only)
+    # ------------------------------------------------------------------
+
+    def _append(self, ids, dates, sources, vectors):
+        start, end = self.count, self.count + len(ids)
+        if end > self.capacity:
+            self._grow(end)
+        self.vectors[start:end] = vectors.astype(self.dtype)
+        self.columns["ids"][start:end] = ids
+        self.columns["dates"][start:end] = dates
+        self.columns["sources"][start:end] = sources
+        self.columns["lists"][start:end] = (np.argmax(vectors @ self.centroids.T, axis=1)
+                                            if self.centroids is not None else 0)
+        self.count = end
+        self.watermark = max(self.watermark, int(ids.max()))
+
+    def _check_model(self, conn):
+        # Vectors from different models are not comparable, so a cutover needs a fresh index
+        with conn.cursor() as cur:
+            cur.execute("SELECT to_regclass('kalshi_embedding_models') IS NOT NULL")
+            row = None
+            if cur.fetchone()[0]:
+                cur.execute("SELECT model_id, dimension FROM kalshi_embedding_models WHERE status = 'active'")
+                row = cur.fetchone()
+        conn.rollback()
+        if row is None:
+            return
+        model, dim = row
+        if not self.count:
+            self.model, self.dim = model, dim
+        elif (self.model or model, self.dim) != (model, dim):
+            raise RuntimeError(f"Local index holds {self.model or 'unknown'} vectors ({self.dim} dims) but "
+                               f"{model} ({dim} dims) is active; sync a new index into a fresh --path")
+        self.model = model
+
+    def sync(self, conn, batch_size=5000):
+        """Append rows with id above the watermark; returns the number of rows added"""
+        if self.readonly:
+            raise RuntimeError("LocalVectorIndex opened read-only")
+        self._check_model(conn)
+        last_id, added = max(0, self.watermark - SYNC_OVERLAP_IDS), 0
+        known = np.asarray(self.columns["ids"][:self.count]) if self.count else np.empty(0, np.int64)
+        known = set(known[known > last_id].tolist())
+        while True:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    SELECT id, source, date, embedding::text
+                    FROM kalshi_documents
+                    WHERE id > %s AND embedding IS NOT NULL
+                    ORDER BY id
+                    LIMIT %s
+                """, (last_id, batch_size))
+                rows = cur.fetchall()
+            conn.rollback()
+            if not rows:
+                break
+            fetched, last_id = len(rows), rows[-1][0]
+            rows = [row for row in rows if row[0] not in known]
+            if rows:
+                ids = np.array([row[0] for row in rows], dtype=np.int64)
+                sources = np.array([SOURCES.index(row[1]) if row[1] in SOURCES else UNKNOWN_SOURCE
+                                    for row in rows], dtype=np.uint8)
+                dates = np.array([_epoch(row[2]) for row in rows], dtype=np.int64)
+                vectors = _unit_rows(np.stack([_parse_vector(row[3]) for row in rows]))
+                self._append(ids, dates, sources, vectors)
+                if self._hnsw is not None:
+                    self._hnsw.resize_index(self.capacity)
+                    self._hnsw.add_items(vectors, np.arange(self.count - len(ids), self.count))
+                added += len(ids)
+            if fetched < batch_size:
+                break
+
+        # Retrain once the corpus has grown well past what the lists were trained on
+        if self.count >= IVF_MIN_ROWS and self.count >= 4 * max(1, self.trained_count):
+            self.train()
+        elif added:
+            if self._hnsw is not None:
+                self._save_hnsw(self._hnsw)
+            self._write_state()
+        if added:
+            print(f"✅ Local index synced {added} rows (total {self.count}, watermark {self.watermark})")
+        return added
+
+    def train(self, sample_size=100_000, build_hnsw=True):
+        """(Re)build IVF centroids and list assignments, and the HNSW graph if hnswlib is available"""
+        vectors = self.vectors[:self.count]
+        nlist = max(1, int(np.sqrt(self.count)))
+        rng = np.random.default_rng(7)
+        sample = vectors[np.sort(rng.choice(self.count, size=min(sample_size, self.count), replace=False))]
+        self.centroids = spherical_kmeans(np.asarray(sample, dtype=np.float32), nlist)
+        for start in range(0, self.count, 65536):
+            chunk = np.asarray(vectors[start:start + 65536], dtype=np.float32)
+            self.columns["lists"][start:start + len(chunk)] = np.argmax(chunk @ self.centroids.T, axis=1)
+        np.save(self._file("centroids.npy"), self.centroids)
+
+        if build_hnsw and hnswlib is not None:
+            graph = hnswlib.Index(space="ip", dim=self.dim)
+            graph.init_index(max_elements=self.capacity, M=16, ef_construction=100)
+            for start in range(0, self.count, 65536):
+                chunk = np.asarray(vectors[start:start + 65536], dtype=np.float32)
+                graph.add_items(chunk, np.arange(start, start + len(chunk)))
+            self._save_hnsw(graph)
+            self._hnsw = graph
+
+        self.trained_count = self.count
+        self._write_state()
+        print(f"✅ Local index trained: {nlist} IVF lists over {self.count} rows")
+
+    # ------------------------------------------------------------------
+    # Search
+    # ------------------------------------------------------------------
+
+    def _candidate_rows(self, query, k, nprobe, use_hnsw=True):
+        if use_hnsw and self._hnsw is not None:
+            self._hnsw.set_ef(max(4 * k, 64))
+            labels, _ = self._hnsw.knn_query(query, k=min(self.count, 4 * k))
+            return labels[0].astype(np.int64)
+        if self.centroids is None or self.count < IVF_MIN_ROWS:
+            return None
+        probes = np.argsort(-(self.centroids @ query))[:nprobe]
+        return np.concatenate([self._postings[p] for p in probes])
+
+    def _filtered(self, query, k, nprobe, source, since, until, use_hnsw):
+        rows = self._candidate_rows(query, k, nprobe, use_hnsw)
+        if rows is None:
+            rows = np.arange(self.count)
+            # The maps are sized to capacity; only the first count rows are written
+            scores = np.concatenate([np.asarray(self.vectors[start:min(start + 65536, self.count)],
+                                                dtype=np.float32) @ query
+                                     for start in range(0, self.count, 65536)])
+        else:
+            rows = rows[rows < self.count]
+            scores = np.asarray(self.vectors[rows], dtype=np.float32) @ query
+
+        mask = np.ones(len(rows), dtype=bool)
+        if source is not None:
+            code = SOURCES.index(source) if source in SOURCES else UNKNOWN_SOURCE
+            mask &= self.columns["sources"][rows] == code
+        if since is not None:
+            mask &= self.columns["dates"][rows] >= _epoch(since)
+        if until is not None:
+            mask &= self.columns["dates"][rows] < _epoch(until)
+        return rows[mask], scores[mask]
+
+    def search(self, query, k=10, source=None, since=None, until=None, nprobe=None):
+        """[(document id, cosine distance)] for the k nearest rows matching the filters"""
+        self.refresh()
+        if not self.count:
+            return []
+        query = np.asarray(query, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+
+        rows, scores = self._filtered(query, k, nprobe or IVF_NPROBE, source, since, until, use_hnsw=True)
+        if len(rows) < k and self._hnsw is not None and (source or since or until):
+            # Graph neighbours were mostly filtered out; fall back to IVF lists / exact scan
+            rows, scores = self._filtered(query, k, nprobe or IVF_NPROBE, source, since, until, use_hnsw=False)
+
+        if len(rows) > k:
+            top = np.argpartition(-scores, k)[:k]
+            rows, scores = rows[top], scores[top]
+        order = np.argsort(-scores)
+        ids = self.columns["ids"][rows[order]]
+        return [(int(doc_id), float(1.0 - score)) for doc_id, score in zip(ids, scores[order])]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain the local kalshi_documents vector replica")
+    parser.add_argument("--path", default=os.environ.get("RAG_LOCAL_INDEX_PATH", "kalshi_local_index"))
+    parser.add_argument("--dtype", choices=("float32", "float16"), default="float32")
+    parser.add_argument("--sync", action="store_true", help="append rows above the id watermark")
+    parser.add_argument("--train", action="store_true", help="rebuild IVF lists (and HNSW) now")
+    parser.add_argument("--every", type=float, help="keep syncing every N seconds")
+    args = parser.parse_args()
+
+    from rag_inference import get_pool
+
+    index = LocalVectorIndex(args.path, dtype=args.dtype, readonly=False)
+    while True:
+        if args.sync:
+            with get_pool().connection() as connection:
+                index.sync(connection)
+        if args.train:
+            index.train()
+            args.train = False
+        if not args.every:
+            break
+        time.sleep(args.every)
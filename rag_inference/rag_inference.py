@@ -1,68 +1,267 @@
 import boto3
 import json
+import os
 import psycopg2
-import numpy as np
+import math
+import time
+from datetime import datetime, timedelta
+from botocore.config import Config
+from functools import lru_cache
+
+from caches import EmbeddingCache, SemanticAnswerCache
+from context_builder import estimate_tokens, select_context
+from db_pool import ConnectionPool
+from local_index import LocalVectorIndex
+from streaming import IncrementalJSONParser, iter_text_deltas
 
 # Cell 3: Configuration
-def get_rds_password():
-    secrets_client = boto3.client('secretsmanager', region_name='ap-southeast-2')
-    response = secrets_client.get_secret_value(
-        SecretId='arn:aws:secretsmanager:ap-southeast-2:647664611140:secret:rds!cluster-7e004f54-e48c-406b-99e8-3a57cea73662-P4k120'
+# Nothing here touches the network; clients, secrets and connections are
+# created on first use so importing this module is cheap.
+RDS_HOST = os.environ.get("RDS_HOST", "kalshi-aurora-rds-instance-1.cr4oq4mee56z.ap-southeast-2.rds.amazonaws.com")
+RDS_DATABASE = os.environ.get("RDS_DATABASE", "postgres")
+RDS_USERNAME = os.environ.get("RDS_USERNAME", "postgres")
+RDS_SECRET_ARN = os.environ.get(
+    "RDS_SECRET_ARN",
+    "arn:aws:secretsmanager:ap-southeast-2:647664611140:secret:rds!cluster-7e004f54-e48c-406b-99e8-3a57cea73662-P4k120"
+)
+AWS_REGION = os.environ.get("AWS_REGION", "ap-southeast-2")
+RDS_POOL_MAX_SIZE = int(os.environ.get("RDS_POOL_MAX_SIZE", "5"))
+RDS_POOL_MAX_AGE = int(os.environ.get("RDS_POOL_MAX_AGE", "1800"))
+# HTTP connections to Bedrock; must cover concurrent batch-scoring calls
+BEDROCK_MAX_CONNECTIONS = int(os.environ.get("BEDROCK_MAX_CONNECTIONS", "32"))
+
+# Queries are embedded with the active model in kalshi_embedding_models (re-read
+# every RAG_EMBED_MODEL_TTL seconds, and at once when a search finds a cutover
+# happened, so a cutover needs no restart); EMBED_MODEL_ID / EMBED_DIMENSION
+# apply until the registry exists
+EMBED_MODEL_ID = os.environ.get("EMBED_MODEL_ID", "amazon.titan-embed-text-v2:0")
+RAG_EMBED_MODEL_TTL = int(os.environ.get("RAG_EMBED_MODEL_TTL", "300"))
+# Query-embedding cache; set RAG_EMBED_CACHE_PATH to keep it across kernel restarts
+RAG_EMBED_CACHE_SIZE = int(os.environ.get("RAG_EMBED_CACHE_SIZE", "1024"))
+RAG_EMBED_CACHE_TTL = int(os.environ.get("RAG_EMBED_CACHE_TTL", str(7 * 24 * 3600)))
+RAG_EMBED_CACHE_PATH = os.environ.get("RAG_EMBED_CACHE_PATH")
+
+LLM_MODEL_ID = os.environ.get("LLM_MODEL_ID", "anthropic.claude-3-sonnet-20240229-v1:0")
+LLM_MAX_TOKENS = int(os.environ.get("LLM_MAX_TOKENS", "700"))
+
+# Semantic answer cache: reuse an analysis for a near-identical question while
+# the corpus watermark (max kalshi_documents.id) has not moved
+RAG_ANSWER_CACHE_THRESHOLD = float(os.environ.get("RAG_ANSWER_CACHE_THRESHOLD", "0.97"))
+RAG_ANSWER_CACHE_SIZE = int(os.environ.get("RAG_ANSWER_CACHE_SIZE", "256"))
+RAG_ANSWER_CACHE_MAX_AGE = int(os.environ.get("RAG_ANSWER_CACHE_MAX_AGE", "3600"))
+RAG_WATERMARK_TTL = float(os.environ.get("RAG_WATERMARK_TTL", "5"))
+
+# "per_source" guarantees top-k per source in one round trip; "hybrid" fuses
+# full-text and vector rankings; "vector" is the original global top-k split client-side
+RAG_RETRIEVAL_MODE = os.environ.get("RAG_RETRIEVAL_MODE", "per_source")
+RAG_PER_SOURCE_TOP_K = {
+    source: int(k) for source, k in (
+        item.split("=") for item in os.environ.get(
+            "RAG_PER_SOURCE_TOP_K", "kalshi=15,social=10,news=5,metaculus=5"
+        ).split(",")
     )
+}
+# Hybrid retrieval: candidates per ranker, final rows, reciprocal rank fusion constant
+RAG_HYBRID_CANDIDATES = int(os.environ.get("RAG_HYBRID_CANDIDATES", "50"))
+RAG_HYBRID_TOP_K = int(os.environ.get("RAG_HYBRID_TOP_K", "30"))
+RAG_RRF_K = int(os.environ.get("RAG_RRF_K", "60"))
+# Default time window / recency decay (unset = all history, no decay); with a
+# partitioned table a window lets the planner skip old partitions
+RAG_WINDOW_DAYS = os.environ.get("RAG_WINDOW_DAYS")
+RAG_RECENCY_HALF_LIFE_DAYS = os.environ.get("RAG_RECENCY_HALF_LIFE_DAYS")
+# Extra candidates fetched per slot when recency decay re-ranks them
+RAG_RECENCY_OVERFETCH = int(os.environ.get("RAG_RECENCY_OVERFETCH", "3"))
+# Prompt evidence budget (~tokens, 0 = no budget/dedup); MinHash Jaccard at or
+# above the threshold counts as a near-duplicate; diversity is the MMR weight
+RAG_CONTEXT_TOKEN_BUDGET = int(os.environ.get("RAG_CONTEXT_TOKEN_BUDGET", "2500"))
+RAG_DEDUP_THRESHOLD = float(os.environ.get("RAG_DEDUP_THRESHOLD", "0.8"))
+RAG_CONTEXT_DIVERSITY = float(os.environ.get("RAG_CONTEXT_DIVERSITY", "0.3"))
+# Per-source row caps in the prompt (the old fixed 15 market / 10 social slices)
+RAG_CONTEXT_CAPS = {"kalshi": 15, "social": 10}
+# Optional in-process k-NN replica (see local_index.py); vector and per_source
+# modes search it locally and only fetch the chosen rows from Aurora
+RAG_LOCAL_INDEX_PATH = os.environ.get("RAG_LOCAL_INDEX_PATH")
+# pgvector >= 0.8: keep scanning the ANN index until a filtered search (per-source
+# branches, time windows) yields its k rows; "off" disables. ivfflat only has relaxed_order
+RAG_ITERATIVE_SCAN = os.environ.get("RAG_ITERATIVE_SCAN", "relaxed_order")
+
+# Quantized first pass (unset / "halfvec" / "binary"; needs the matching index from
+# VectorIndexManager.create_quantized_index), re-ranked exactly over
+# RAG_RERANK_FACTOR x k candidates
+RAG_QUANTIZATION = os.environ.get("RAG_QUANTIZATION") or None
+RAG_RERANK_FACTOR = int(os.environ.get("RAG_RERANK_FACTOR", "0"))  # 0 = 4 for halfvec, 10 for binary
+EMBEDDING_DIM = int(os.environ.get("EMBED_DIMENSION", "1024"))
+QUANTIZED_ORDER = {
+    "halfvec": "embedding::halfvec({dim}) <=> %s::halfvec({dim})",
+    "binary": "binary_quantize(embedding)::bit({dim}) <~> binary_quantize(%s::vector)",
+}
+
+# ANN recall knobs (unset = server default); ivfflat.probes for ivfflat, hnsw.ef_search for HNSW
+RAG_IVFFLAT_PROBES = os.environ.get("RAG_IVFFLAT_PROBES")
+RAG_HNSW_EF_SEARCH = os.environ.get("RAG_HNSW_EF_SEARCH")
+# pgvector rejects a larger hnsw.ef_search, which also bounds the rows one HNSW scan returns
+MAX_EF_SEARCH = 1000
+
+@lru_cache(maxsize=None)
+def get_bedrock():
+    config = Config(
+        max_pool_connections=BEDROCK_MAX_CONNECTIONS,
+        retries={"max_attempts": 8, "mode": "adaptive"}
+    )
+    return boto3.client("bedrock-runtime", region_name=AWS_REGION, config=config)
+
+@lru_cache(maxsize=None)
+def get_rds_password():
+    secrets_client = boto3.client('secretsmanager', region_name=AWS_REGION)
+    response = secrets_client.get_secret_value(SecretId=RDS_SECRET_ARN)
     secret = json.loads(response['SecretString'])
     return secret['password']
 
-RDS_HOST = "kalshi-aurora-rds-instance-1.cr4oq4mee56z.ap-southeast-2.rds.amazonaws.com"
-RDS_DATABASE = "postgres"
-RDS_USERNAME = "postgres"
-RDS_PASSWORD = get_rds_password()
-AWS_REGION = "ap-southeast-2"
+def _open_connection():
+    return psycopg2.connect(
+        host=RDS_HOST, database=RDS_DATABASE, user=RDS_USERNAME,
+        password=get_rds_password(), port=5432, sslmode='require'
+    )
+
+@lru_cache(maxsize=None)
+def get_pool():
+    """Shared pool; a rotated secret is re-fetched when a new connection fails auth"""
+    return ConnectionPool(
+        _open_connection,
+        max_size=RDS_POOL_MAX_SIZE,
+        max_age=RDS_POOL_MAX_AGE,
+        on_auth_failure=get_rds_password.cache_clear
+    )
+
+@lru_cache(maxsize=None)
+def get_embedding_cache():
+    return EmbeddingCache(
+        max_entries=RAG_EMBED_CACHE_SIZE,
+        ttl_seconds=RAG_EMBED_CACHE_TTL,
+        path=RAG_EMBED_CACHE_PATH
+    )
 
-bedrock = boto3.client("bedrock-runtime", region_name=AWS_REGION)
-print("✅ Configuration loaded")
+@lru_cache(maxsize=None)
+def get_answer_cache():
+    return SemanticAnswerCache(
+        threshold=RAG_ANSWER_CACHE_THRESHOLD,
+        max_entries=RAG_ANSWER_CACHE_SIZE,
+        max_age_seconds=RAG_ANSWER_CACHE_MAX_AGE
+    )
 
 # Cell 4: Generate embedding function
-def generate_embedding(text):
-    response = bedrock.invoke_model(
-        modelId="amazon.titan-embed-text-v2:0",
-        body=json.dumps({"inputText": text}),
+@lru_cache(maxsize=None)
+def _open_local_index():
+    return LocalVectorIndex(RAG_LOCAL_INDEX_PATH)
+
+def get_local_index():
+    """Read-only view of the local replica, or None when RAG_LOCAL_INDEX_PATH is unset/not synced yet"""
+    if not RAG_LOCAL_INDEX_PATH:
+        return None
+    index = _open_local_index()
+    # A stat when nothing changed; picks up the first --sync even if it ran after startup
+    index.refresh()
+    return index if index.count else None
+
+class StaleEmbeddingModel(Exception):
+    """A cutover replaced the model the query was embedded with"""
+
+def active_embedding_model(refresh=False):
+    """(model_id, dimension) of the vectors in kalshi_documents.embedding, cached briefly"""
+    global _active_model
+    now = time.monotonic()
+    if refresh or _active_model is None or now - _active_model[1] > RAG_EMBED_MODEL_TTL:
+        model, from_registry = (EMBED_MODEL_ID, EMBEDDING_DIM), False
+        with get_pool().connection() as conn, conn.cursor() as cur:
+            cur.execute("SELECT to_regclass('kalshi_embedding_models') IS NOT NULL")
+            if cur.fetchone()[0]:
+                cur.execute("SELECT model_id, dimension FROM kalshi_embedding_models WHERE status = 'active'")
+                row = cur.fetchone()
+                model, from_registry = (tuple(row), True) if row else (model, False)
+        _active_model = (model, now, from_registry)
+    return _active_model[0]
+
+# (model, loaded_at, from_registry)
+_active_model = None
+
+def _check_active_model(cur, model_id):
+    """Raise StaleEmbeddingModel if model_id is no longer active.
+
+    Run after the vector query in the same transaction: a cutover renames
+    the embedding column under an exclusive lock, so it either committed
+    before the query (and is seen here) or waits until this transaction ends.
+    """
+    # Without a registry there is nothing to cut over, so nothing to check
+    if model_id is None or not _active_model or not _active_model[2]:
+        return
+    cur.execute("SELECT model_id FROM kalshi_embedding_models WHERE status = 'active'")
+    row = cur.fetchone()
+    if row and row[0] != model_id:
+        raise StaleEmbeddingModel(f"{model_id} was replaced by {row[0]}")
+
+def local_index_for(embedding):
+    """The local replica, unless it was built from another embedding model (then search Aurora)"""
+    index = get_local_index()
+    if index is None:
+        return None
+    if index.dim != len(embedding) or (index.model and index.model != active_embedding_model()[0]):
+        return None
+    return index
+
+def _embedding_request(model_id, text, dimension):
+    if model_id.startswith("cohere.embed"):
+        return {"texts": [text], "input_type": "search_query", "truncate": "END"}
+    if "titan-embed-text-v2" in model_id:
+        return {"inputText": text, "dimensions": dimension}
+    return {"inputText": text}
+
+def generate_embedding(text, use_cache=True, model=None):
+    """Embed text with model (model_id, dimension), default the active one"""
+    model_id, dimension = model or active_embedding_model()
+    cache = get_embedding_cache()
+    if use_cache:
+        cached = cache.get(text, model_id)
+        if cached is not None:
+            return cached
+
+    response = get_bedrock().invoke_model(
+        modelId=model_id,
+        body=json.dumps(_embedding_request(model_id, text, dimension)),
         contentType="application/json",
         accept="application/json"
     )
-    return json.loads(response["body"].read()).get("embedding", [])
+    payload = json.loads(response["body"].read())
+    embedding = payload["embeddings"][0] if "embeddings" in payload else payload.get("embedding", [])
+    if len(embedding) != dimension:
+        raise ValueError(f"{model_id} returned {len(embedding)} dimensions, expected {dimension}")
+    if use_cache:
+        cache.put(text, model_id, embedding)
+    return embedding
+
+def to_vector_literal(embedding):
+    """pgvector text form, so the query compares native vectors and can use the ANN index"""
+    return "[" + ",".join(f"{x:.8g}" for x in embedding) + "]"
 
 # Cell 5: Test database connection
 def test_connection():
     try:
-        conn = psycopg2.connect(
-            host=RDS_HOST, database=RDS_DATABASE, user=RDS_USERNAME,
-            password=RDS_PASSWORD, port=5432, sslmode='require'
-        )
-        with conn.cursor() as cur:
+        with get_pool().connection() as conn, conn.cursor() as cur:
             cur.execute("SELECT COUNT(*) FROM kalshi_documents;")
             count = cur.fetchone()[0]
             print(f"✅ Connected! Found {count} documents")
-        conn.close()
         return True
     except Exception as e:
         print(f"❌ Connection failed: {e}")
         return False
 
-test_connection()
-
 # Cell 6: Check sentiment data in database
 def check_sentiment_data():
     try:
-        conn = psycopg2.connect(
-            host=RDS_HOST, database=RDS_DATABASE, user=RDS_USERNAME,
-            password=RDS_PASSWORD, port=5432, sslmode='require'
-        )
-        
-        with conn.cursor() as cur:
+        with get_pool().connection() as conn, conn.cursor() as cur:
             cur.execute("""
                 SELECT topic, COUNT(*) as count, MIN(date) as earliest, MAX(date) as latest
                 FROM kalshi_documents 
-                WHERE topic LIKE '%sentiment%'
+                WHERE source = 'social'
                 GROUP BY topic
                 ORDER BY count DESC
             """)
@@ -76,7 +275,7 @@ def check_sentiment_data():
             cur.execute("""
                 SELECT topic, COUNT(*) as count
                 FROM kalshi_documents 
-                WHERE topic ILIKE '%jersey%' OR topic ILIKE '%governor%'
+                WHERE text_search @@ to_tsquery('english', 'jersey:A | governor:A')  -- weight A = topic, GIN-backed
                 GROUP BY topic
                 ORDER BY count DESC
             """)
@@ -87,63 +286,358 @@ def check_sentiment_data():
                 topic, count = row
                 print(f"  • {topic}: {count} records")
         
-        conn.close()
-        
     except Exception as e:
         print(f"❌ Error: {e}")
 
-check_sentiment_data()
-
 # Cell 7: Pure Vector K-NN RAG (No hardcoded filters)
-def kalshi_pure_vector_rag(question, top_k=50):
-    try:
-        print(f"🔍 Pure Vector Search: {question}")
-        
-        query_vector = generate_embedding(question)
-        
-        conn = psycopg2.connect(
-            host=RDS_HOST, database=RDS_DATABASE, user=RDS_USERNAME,
-            password=RDS_PASSWORD, port=5432, sslmode='require'
-        )
-        
-        with conn.cursor() as cur:
-            # Pure vector similarity - no topic filtering
-            cur.execute("""
-                SELECT text, topic, date, 
-                       (embedding::text::vector) <=> %s::vector as distance
+def apply_search_settings(cur, probes=None, ef_search=None):
+    """SET LOCAL the ANN recall knobs for this transaction (pooled connections roll back on return)"""
+    probes = probes if probes is not None else RAG_IVFFLAT_PROBES
+    ef_search = ef_search if ef_search is not None else RAG_HNSW_EF_SEARCH
+    if probes is not None:
+        cur.execute("SELECT set_config('ivfflat.probes', %s, true)", (str(int(probes)),))
+    if ef_search is not None:
+        cur.execute("SELECT set_config('hnsw.ef_search', %s, true)", (str(min(int(ef_search), MAX_EF_SEARCH)),))
+
+def _window_clause(since=None, until=None):
+    """Extra WHERE terms on date; literal bounds let the planner prune partitions"""
+    sql, params = "", []
+    if since is not None:
+        sql += " AND date >= %s"
+        params.append(since)
+    if until is not None:
+        sql += " AND date < %s"
+        params.append(until)
+    return sql, params
+
+def _shortlist_size(quantization, k):
+    return max(k, min(k * (RAG_RERANK_FACTOR or (4 if quantization == "halfvec" else 10)), MAX_EF_SEARCH))
+
+def _nearest(query_vector, k, where_sql="TRUE", where_params=(), quantization=None):
+    """(sql, params) selecting the k nearest (source, text, topic, date, distance) rows.
+
+    With a quantization the ORDER BY runs on the compact representation (and
+    its index) for a shortlist, which is then re-ranked on the full vectors.
+    """
+    if not quantization:
+        # Re-sorted outside the index scan, whose order is only approximate with relaxed_order
+        sql = f"""
+            SELECT * FROM (
+                SELECT source, text, topic, date, embedding <=> %s::vector AS distance
                 FROM kalshi_documents
-                ORDER BY (embedding::text::vector) <=> %s::vector
+                WHERE {where_sql}
+                ORDER BY embedding <=> %s::vector
                 LIMIT %s
-            """, (query_vector, query_vector, top_k))
-            
-            results = cur.fetchall()
-        
-        conn.close()
-        
-        # Separate by data type
-        kalshi_data = []
-        social_data = []
-        
-        print("📊 Top Vector Matches:")
-        for i, (text, topic, date, distance) in enumerate(results[:10]):
-            print(f"  {i+1}. [{distance:.3f}] {topic[:50]}...")
-            
-            if "social sentiment" in topic:
-                social_data.append(f"[{date}] {text}")
-            else:
-                kalshi_data.append(text)
-        
-        kalshi_context = "\n".join(kalshi_data[:15])
-        social_context = "\n".join(social_data[:10])
+            ) nearest
+            ORDER BY distance"""
+        return sql, [query_vector, *where_params, query_vector, k]
+    sql = f"""
+            SELECT source, text, topic, date, embedding <=> %s::vector AS distance
+            FROM (
+                SELECT source, text, topic, date, embedding
+                FROM kalshi_documents
+                WHERE {where_sql}
+                ORDER BY {QUANTIZED_ORDER[quantization].format(dim=active_embedding_model()[1])}
+                LIMIT %s
+            ) shortlist
+            ORDER BY distance
+            LIMIT %s"""
+    return sql, [query_vector, *where_params, query_vector, _shortlist_size(quantization, k), k]
+
+@lru_cache(maxsize=None)
+def pgvector_version():
+    with get_pool().connection() as conn, conn.cursor() as cur:
+        cur.execute("SELECT extversion FROM pg_extension WHERE extname = 'vector'")
+        row = cur.fetchone()
+    version = tuple(int(part) for part in row[0].split(".")[:2]) if row else (0, 0)
+    if version < (0, 8):
+        print(f"⚠️ pgvector {'.'.join(map(str, version))} has no iterative index scans; "
+              f"filtered searches can return fewer than k rows for rare sources")
+    return version
+
+def _search_settings(cur, probes, ef_search, quantization, largest_k):
+    # HNSW returns at most ef_search rows, so it has to cover every row the scan is asked for
+    wanted = _shortlist_size(quantization, largest_k) if quantization else largest_k
+    ef_search = min(max(int(ef_search or RAG_HNSW_EF_SEARCH or 40), wanted), MAX_EF_SEARCH)
+    apply_search_settings(cur, probes, ef_search)
+    if RAG_ITERATIVE_SCAN != "off" and pgvector_version() >= (0, 8):
+        cur.execute("SELECT set_config('hnsw.iterative_scan', %s, true), "
+                    "set_config('ivfflat.iterative_scan', 'relaxed_order', true)", (RAG_ITERATIVE_SCAN,))
+
+def search_documents(query_vector, top_k=50, probes=None, ef_search=None, since=None, until=None,
+                     quantization=None, model_id=None):
+    """Top-k (source, text, topic, date, distance) rows by cosine distance.
+
+    With model_id (the model query_vector came from), raises
+    StaleEmbeddingModel if a cutover replaced it; likewise for the other searches.
+    """
+    quantization = quantization or RAG_QUANTIZATION
+    window_sql, window_params = _window_clause(since, until)
+    # Pure vector similarity - no topic filtering; ORDER BY on the raw
+    # column is what lets the planner use kalshi_embedding_idx
+    sql, params = _nearest(query_vector, top_k, "TRUE" + window_sql, window_params, quantization)
+    with get_pool().connection() as conn, conn.cursor() as cur:
+        _search_settings(cur, probes, ef_search, quantization, top_k)
+        cur.execute(sql, params)
+        rows = cur.fetchall()
+        _check_active_model(cur, model_id)
+        return rows
+
+def search_per_source(query_vector, per_source_k=None, probes=None, ef_search=None, since=None, until=None,
+                      quantization=None, model_id=None):
+    """Top-k rows for every source in a single query, so no source can crowd out another.
+
+    One ORDER BY ... LIMIT branch per source, glued with UNION ALL; each
+    branch filters on the indexed source column and can use the ANN index.
+    """
+    per_source_k = per_source_k or RAG_PER_SOURCE_TOP_K
+    quantization = quantization or RAG_QUANTIZATION
+    window_sql, window_params = _window_clause(since, until)
+    branches, params = [], []
+    for source, k in per_source_k.items():
+        if k <= 0:
+            continue
+        sql, branch_params = _nearest(query_vector, k, "source = %s" + window_sql,
+                                      [source, *window_params], quantization)
+        branches.append(f"({sql})")
+        params.extend(branch_params)
+    if not branches:
+        return []
+
+    with get_pool().connection() as conn, conn.cursor() as cur:
+        _search_settings(cur, probes, ef_search, quantization, max(per_source_k.values()))
+        cur.execute(" UNION ALL ".join(branches), params)
+        rows = cur.fetchall()
+        _check_active_model(cur, model_id)
+        return rows
+
+def fetch_documents(matches):
+    """(source, text, topic, date, distance) rows for [(id, distance)] matches, in match order"""
+    if not matches:
+        return []
+    with get_pool().connection() as conn, conn.cursor() as cur:
+        cur.execute("""
+            SELECT id, source, text, topic, date
+            FROM kalshi_documents
+            WHERE id = ANY(%s)
+        """, ([doc_id for doc_id, _ in matches],))
+        rows = {row[0]: row[1:] for row in cur.fetchall()}
+    # Rows deleted since the replica was synced are skipped
+    return [(*rows[doc_id], distance) for doc_id, distance in matches if doc_id in rows]
+
+def search_local(index, embedding, per_source_k=None, top_k=None, since=None, until=None):
+    """Same rows as search_per_source / search_documents, k-NN done in-process"""
+    if per_source_k is None:
+        matches = index.search(embedding, top_k, since=since, until=until)
+    else:
+        matches = [match for source, k in per_source_k.items() if k > 0
+                   for match in index.search(embedding, k, source=source, since=since, until=until)]
+    return fetch_documents(matches)
+
+def search_hybrid(query_vector, query_text, top_k=None, candidates=None, since=None, until=None, model_id=None):
+    """Reciprocal rank fusion of pgvector and GIN full-text rankings in one query.
+
+    Exact entity matches (candidate names, tickers) that embed poorly still
+    surface through the lexical ranker. Query terms are OR-ed so a
+    question does not need every word to match.
+    """
+    window_sql = (" AND date >= %(since)s" if since is not None else "") + \
+                 (" AND date < %(until)s" if until is not None else "")
+    candidates = candidates or RAG_HYBRID_CANDIDATES
+    with get_pool().connection() as conn, conn.cursor() as cur:
+        _search_settings(cur, None, None, None, candidates)
+        cur.execute(f"""
+            WITH vector_ranked AS (
+                SELECT id, ROW_NUMBER() OVER (ORDER BY distance) AS rank
+                FROM (
+                    SELECT id, embedding <=> %(vector)s::vector AS distance
+                    FROM kalshi_documents
+                    WHERE TRUE{window_sql}
+                    ORDER BY embedding <=> %(vector)s::vector
+                    LIMIT %(candidates)s
+                ) v
+            ),
+            lexical_ranked AS (
+                SELECT id, ROW_NUMBER() OVER (ORDER BY score DESC) AS rank
+                FROM (
+                    SELECT id, ts_rank_cd(text_search, query) AS score
+                    FROM kalshi_documents,
+                         CAST(replace(plainto_tsquery('english', %(text)s)::text, '&', '|') AS tsquery) AS query
+                    WHERE text_search @@ query{window_sql}
+                    ORDER BY score DESC
+                    LIMIT %(candidates)s
+                ) l
+            ),
+            fused AS (
+                SELECT COALESCE(v.id, l.id) AS id,
+                       COALESCE(1.0 / (%(rrf_k)s + v.rank), 0) + COALESCE(1.0 / (%(rrf_k)s + l.rank), 0) AS score
+                FROM vector_ranked v FULL OUTER JOIN lexical_ranked l ON v.id = l.id
+                ORDER BY score DESC
+                LIMIT %(top_k)s
+            )
+            SELECT d.source, d.text, d.topic, d.date, d.embedding <=> %(vector)s::vector AS distance
+            FROM fused f JOIN kalshi_documents d ON d.id = f.id
+            ORDER BY f.score DESC
+        """, {
+            "vector": query_vector,
+            "text": query_text,
+            "candidates": candidates,
+            "rrf_k": RAG_RRF_K,
+            "top_k": top_k or RAG_HYBRID_TOP_K,
+            "since": since,
+            "until": until,
+        })
+        rows = cur.fetchall()
+        _check_active_model(cur, model_id)
+        return rows
+
+def _source_of(source, topic):
+    # Rows written before the source column existed
+    if source:
+        return source
+    return "social" if "social sentiment" in topic else "kalshi"
+
+def split_context(results, limit=10):
+    """Group matches into prompt lines by source (only the first limit rows, if set)"""
+    context = {"kalshi": [], "social": [], "news": [], "metaculus": []}
+    
+    print("📊 Top Vector Matches:")
+    for i, (source, text, topic, date, distance) in enumerate(results[:limit] if limit else results):
+        print(f"  {i+1}. [{distance:.3f}] {topic[:50]}...")
         
-        prompt = f"""You are a Kalshi ROI analyst. Use market data + social sentiment for profitable opportunities.
+        source = _source_of(source, topic)
+        if source in ("social", "news"):
+            context.setdefault(source, []).append(f"[{date}] {text}")
+        else:
+            context.setdefault(source, []).append(text)
+    return context
+
+def _age_days(date, now):
+    if isinstance(date, str):
+        try:
+            date = datetime.fromisoformat(date)
+        except ValueError:
+            return 0.0
+    if date is None:
+        return 0.0
+    return max(0.0, (now - date.replace(tzinfo=None)).total_seconds() / 86400.0)
+
+def apply_recency_decay(results, half_life_days, keep=None):
+    """Re-rank by similarity * 0.5 ** (age / half_life).
+
+    keep is either a row count or a {source: count} dict of per-source quotas.
+    """
+    now = datetime.utcnow()
+    scored = sorted(
+        results,
+        key=lambda row: (1.0 - row[4]) * math.pow(0.5, _age_days(row[3], now) / half_life_days),
+        reverse=True
+    )
+    if not isinstance(keep, dict):
+        return scored[:keep]
+    kept, counts = [], {}
+    for row in scored:
+        if counts.get(row[0], 0) < keep.get(row[0], 0):
+            counts[row[0]] = counts.get(row[0], 0) + 1
+            kept.append(row)
+    return kept
+
+def resolve_window(since=None, until=None, window_days=None):
+    """Explicit bounds win; otherwise window_days (or RAG_WINDOW_DAYS) back from now"""
+    window_days = window_days if window_days is not None else RAG_WINDOW_DAYS
+    if since is None and window_days:
+        since = datetime.utcnow() - timedelta(days=float(window_days))
+    return since, until
+
+def _search(embedding, top_k, mode, question, since, until, overfetch, model_id):
+    """(rows, keep) from the search for mode"""
+    query_vector = to_vector_literal(embedding)
+    if mode == "hybrid":
+        results = search_hybrid(query_vector, question or "", top_k=RAG_HYBRID_TOP_K * overfetch,
+                                since=since, until=until, model_id=model_id)
+        return results, RAG_HYBRID_TOP_K
+    if mode == "per_source":
+        per_source_k = {source: k * overfetch for source, k in RAG_PER_SOURCE_TOP_K.items()}
+        local = local_index_for(embedding)
+        if local is not None:
+            results = search_local(local, embedding, per_source_k=per_source_k, since=since, until=until)
+        else:
+            results = search_per_source(query_vector, per_source_k, since=since, until=until, model_id=model_id)
+        return results, RAG_PER_SOURCE_TOP_K
+    if mode == "vector":
+        local = local_index_for(embedding)
+        if local is not None:
+            results = search_local(local, embedding, top_k=top_k * overfetch, since=since, until=until)
+        else:
+            results = search_documents(query_vector, top_k * overfetch, since=since, until=until,
+                                       model_id=model_id)
+        return results, top_k
+    raise ValueError(f"Unknown retrieval mode: {mode}")
+
+def retrieve_context(embedding, top_k=50, mode=None, question=None,
+                     since=None, until=None, window_days=None, half_life_days=None, model_id=None):
+    """(context, rows fetched) for the configured retrieval mode.
+
+    since/until (or window_days) restrict the date range; half_life_days
+    over-fetches candidates and re-ranks them with exponential recency decay.
+    model_id is the model embedding came from; if a cutover replaced it,
+    the question is re-embedded with the new model and searched again.
+    """
+    mode = mode or RAG_RETRIEVAL_MODE
+    since, until = resolve_window(since, until, window_days)
+    half_life_days = half_life_days if half_life_days is not None else RAG_RECENCY_HALF_LIFE_DAYS
+    half_life_days = float(half_life_days) if half_life_days else None
+    overfetch = RAG_RECENCY_OVERFETCH if half_life_days else 1
+
+    try:
+        results, keep = _search(embedding, top_k, mode, question, since, until, overfetch, model_id)
+    except (StaleEmbeddingModel, psycopg2.DataError):
+        # A cutover to another dimension fails the vector query itself, before the check
+        model = active_embedding_model(refresh=True)
+        if not question or model_id is None or model[0] == model_id:
+            raise
+        print(f"🔁 {model_id} was replaced by {model[0]}; re-embedding the question")
+        embedding = generate_embedding(question, model=model)
+        results, keep = _search(embedding, top_k, mode, question, since, until, overfetch, model[0])
+    if half_life_days:
+        results = apply_recency_decay(results, half_life_days, keep)
+    fetched = len(results)
+
+    if RAG_CONTEXT_TOKEN_BUDGET > 0:
+        return split_context(pack_context(results), limit=None), fetched
+    return split_context(results, limit=10 if mode == "vector" else None), fetched
+
+def pack_context(results, token_budget=None):
+    """Drop near-duplicate rows and pick a relevant, diverse subset that fits the token budget"""
+    token_budget = token_budget or RAG_CONTEXT_TOKEN_BUDGET
+    chosen, duplicates = select_context(
+        results, token_budget, caps=RAG_CONTEXT_CAPS,
+        dedup_threshold=RAG_DEDUP_THRESHOLD, diversity=RAG_CONTEXT_DIVERSITY,
+        # Social/news lines carry a "[date] " prefix in the prompt
+        line_of=lambda row: f"[{row[3]}] {row[1]}" if row[0] in ("social", "news") else row[1]
+    )
+    tokens = sum(estimate_tokens(row[1]) for row in chosen)
+    print(f"🧹 Context: {len(chosen)}/{len(results)} rows, ~{tokens} tokens, {duplicates} near-duplicates dropped")
+    return chosen
+
+def build_prompt(question, context):
+    kalshi_context = "\n".join(context.get("kalshi", [])[:15])
+    social_context = "\n".join(context.get("social", [])[:10])
+    # News / Metaculus sections only appear once those sources are ingested
+    extra_sections = ""
+    if context.get("news"):
+        extra_sections += "\nNEWS:\n" + "\n".join(context["news"]) + "\n"
+    if context.get("metaculus"):
+        extra_sections += "\nFORECASTER CONSENSUS (Metaculus):\n" + "\n".join(context["metaculus"]) + "\n"
+    
+    return f"""You are a Kalshi ROI analyst. Use market data + social sentiment for profitable opportunities.
 
 MARKET DATA (Question,Option,Date,Odds %):
 {kalshi_context}
 
 SOCIAL SENTIMENT:
 {social_context}
-
+{extra_sections}
 Question: {question}
 
 Analyze for ROI opportunities:
@@ -166,73 +660,213 @@ Return JSON:
     "reasoning": "detailed analysis"
 }}"""
 
-        # Generate analysis
-        llm_response = bedrock.invoke_model(
-            modelId="anthropic.claude-3-sonnet-20240229-v1:0",
-            body=json.dumps({
-                "anthropic_version": "bedrock-2023-05-31",
-                "messages": [{"role": "user", "content": prompt}],
-                "max_tokens": 700
-            }),
-            contentType="application/json",
-            accept="application/json"
-        )
+def llm_request_body(prompt):
+    return json.dumps({
+        "anthropic_version": "bedrock-2023-05-31",
+        "messages": [{"role": "user", "content": prompt}],
+        "max_tokens": LLM_MAX_TOKENS
+    })
+
+def invoke_analysis(prompt):
+    """Run the Claude generation and return the completion text"""
+    llm_response = get_bedrock().invoke_model(
+        modelId=LLM_MODEL_ID,
+        body=llm_request_body(prompt),
+        contentType="application/json",
+        accept="application/json"
+    )
+    
+    llm_result = json.loads(llm_response["body"].read())
+    return llm_result["content"][0]["text"]
+
+def stream_analysis(prompt):
+    """Yield the Claude completion text piece by piece as Bedrock streams it"""
+    response = get_bedrock().invoke_model_with_response_stream(
+        modelId=LLM_MODEL_ID,
+        body=llm_request_body(prompt),
+        contentType="application/json",
+        accept="application/json"
+    )
+    yield from iter_text_deltas(response["body"])
+
+def parse_analysis(completion):
+    try:
+        if "```json" in completion:
+            json_start = completion.find("```json") + 7
+            json_end = completion.find("```", json_start)
+            json_text = completion[json_start:json_end].strip()
+        else:
+            json_text = completion
         
-        llm_result = json.loads(llm_response["body"].read())
-        completion = llm_result["content"][0]["text"]
+        return json.loads(json_text)
+    except:
+        return {"error": "Parse failed", "raw": completion[:200]}
 
-        # Parse response
-        try:
-            if "```json" in completion:
-                json_start = completion.find("```json") + 7
-                json_end = completion.find("```", json_start)
-                json_text = completion[json_start:json_end].strip()
-            else:
-                json_text = completion
-            
-            analysis = json.loads(json_text)
-        except:
-            analysis = {"error": "Parse failed", "raw": completion[:200]}
-
-        return {
-            "question": question,
-            "roi_analysis": analysis,
-            "data_breakdown": {
-                "kalshi_records": len(kalshi_data),
-                "social_posts": len(social_data),
-                "total_matches": len(results)
-            }
+def corpus_watermark():
+    """Highest document id, cached briefly; it only moves when new rows are ingested"""
+    global _watermark
+    now = time.monotonic()
+    if _watermark is None or now - _watermark[1] > RAG_WATERMARK_TTL:
+        with get_pool().connection() as conn, conn.cursor() as cur:
+            cur.execute("SELECT COALESCE(MAX(id), 0) FROM kalshi_documents;")
+            _watermark = (cur.fetchone()[0], now)
+    return _watermark[0]
+
+_watermark = None
+
+def answer_cache_key(retrieval_mode, since, until, window_days, half_life_days):
+    """(watermark, settings): answers are only reusable for the same data, embedding model and retrieval settings"""
+    settings = (active_embedding_model()[0], retrieval_mode or RAG_RETRIEVAL_MODE,
+                since, until, window_days, half_life_days)
+    return corpus_watermark(), settings
+
+def cached_answer(question, embedding, watermark, settings):
+    cached = get_answer_cache().lookup(embedding, watermark, settings)
+    if cached is None:
+        return None
+    result, similarity, matched_question = cached
+    print(f"⚡ Answer cache hit ({similarity:.3f}): {matched_question}")
+    return {**result, "question": question,
+            "cache": {"hit": True, "similarity": similarity, "matched_question": matched_question}}
+
+def rag_result(question, analysis, context, total_matches):
+    return {
+        "question": question,
+        "roi_analysis": analysis,
+        "data_breakdown": {
+            "kalshi_records": len(context["kalshi"]),
+            "social_posts": len(context["social"]),
+            "news_articles": len(context["news"]),
+            "metaculus_forecasts": len(context["metaculus"]),
+            "total_matches": total_matches
         }
+    }
+
+def kalshi_pure_vector_rag(question, top_k=50, use_answer_cache=True, retrieval_mode=None,
+                           since=None, until=None, window_days=None, half_life_days=None):
+    try:
+        print(f"🔍 Pure Vector Search: {question}")
+        
+        model = active_embedding_model()
+        embedding = generate_embedding(question, model=model)
+
+        if use_answer_cache:
+            watermark, settings = answer_cache_key(retrieval_mode, since, until, window_days, half_life_days)
+            cached = cached_answer(question, embedding, watermark, settings)
+            if cached is not None:
+                return cached
+
+        context, total_matches = retrieve_context(
+            embedding, top_k, retrieval_mode, question,
+            since=since, until=until, window_days=window_days, half_life_days=half_life_days,
+            model_id=model[0]
+        )
+        
+        prompt = build_prompt(question, context)
+
+        # Generate analysis
+        analysis = parse_analysis(invoke_analysis(prompt))
+
+        result = rag_result(question, analysis, context, total_matches)
+        if use_answer_cache and "error" not in analysis:
+            get_answer_cache().store(embedding, question, result, watermark, settings)
+        return result
 
     except Exception as e:
         return {"error": str(e)}
 
-# Cell 8: Test pure vector approach
-result = kalshi_pure_vector_rag("New Jersey Governor Election")
-print("\n💰 Pure Vector ROI Analysis:")
-print(json.dumps(result, indent=2))
+def stream_roi_analysis(question, top_k=50, use_answer_cache=True, retrieval_mode=None,
+                        since=None, until=None, window_days=None, half_life_days=None):
+    """Streaming kalshi_pure_vector_rag: yields events while Claude is still generating.
+
+    - {"type": "token", "text": ...} for every streamed piece of the completion
+    - {"type": "field", "name": ..., "value": ...} as each top-level JSON field
+      (best_opportunity, expected_roi_percentage, ...) is complete
+    - {"type": "done", "result": ...} last, with the same dict kalshi_pure_vector_rag returns
+
+    An answer cache hit replays the cached fields then finishes without calling Bedrock.
+    """
+    try:
+        print(f"🔍 Pure Vector Search (streaming): {question}")
+
+        model = active_embedding_model()
+        embedding = generate_embedding(question, model=model)
+
+        if use_answer_cache:
+            watermark, settings = answer_cache_key(retrieval_mode, since, until, window_days, half_life_days)
+            cached = cached_answer(question, embedding, watermark, settings)
+            if cached is not None:
+                for name, value in cached["roi_analysis"].items():
+                    yield {"type": "field", "name": name, "value": value}
+                yield {"type": "done", "result": cached}
+                return
+
+        context, total_matches = retrieve_context(
+            embedding, top_k, retrieval_mode, question,
+            since=since, until=until, window_days=window_days, half_life_days=half_life_days,
+            model_id=model[0]
+        )
+        prompt = build_prompt(question, context)
+
+        parser = IncrementalJSONParser()
+        for text in stream_analysis(prompt):
+            yield {"type": "token", "text": text}
+            for name, value in parser.feed(text):
+                yield {"type": "field", "name": name, "value": value}
+
+        analysis = parser.result()
+        if analysis is None:
+            analysis = parse_analysis(parser.text)
+        result = rag_result(question, analysis, context, total_matches)
+        if use_answer_cache and "error" not in analysis:
+            get_answer_cache().store(embedding, question, result, watermark, settings)
+        yield {"type": "done", "result": result}
+
+    except Exception as e:
+        yield {"type": "done", "result": {"error": str(e)}}
 
 # Cell 9: Interactive Query Function
+ANALYSIS_LABELS = {
+    "best_opportunity": ("\n🎯 Best Opportunity", ""),
+    "expected_roi_percentage": ("📊 Expected ROI", "%"),
+    "sentiment_momentum": ("📈 Sentiment", ""),
+    "confidence": ("🎲 Confidence", ""),
+    "reasoning": ("💡 Reasoning", ""),
+}
+
 def interactive_roi_query():
     while True:
         question = input("\n💰 Enter your Kalshi question (or 'quit'): ")
         if question.lower() == 'quit':
             break
         
-        result = kalshi_pure_vector_rag(question)
-        
-        if "error" in result:
-            print(f"❌ Error: {result['error']}")
-        else:
-            analysis = result["roi_analysis"]
-            print(f"\n🎯 Best Opportunity: {analysis.get('best_opportunity', 'N/A')}")
-            print(f"📊 Expected ROI: {analysis.get('expected_roi_percentage', 0)}%")
-            print(f"📈 Sentiment: {analysis.get('sentiment_momentum', 'N/A')}")
-            print(f"🎲 Confidence: {analysis.get('confidence', 'N/A')}")
-            print(f"💡 Reasoning: {analysis.get('reasoning', 'N/A')}")
-
-# Uncomment to run interactive mode
-# interactive_roi_query()
-
-print("\n✅ Kalshi Pure Vector ROI Analysis System Ready!")
-print("Use kalshi_pure_vector_rag('your question') for ROI-focused predictions")
+        # Print each field the moment Claude finishes it instead of waiting for the whole answer
+        for event in stream_roi_analysis(question):
+            if event["type"] == "field" and event["name"] in ANALYSIS_LABELS:
+                label, suffix = ANALYSIS_LABELS[event["name"]]
+                print(f"{label}: {event['value']}{suffix}", flush=True)
+            elif event["type"] == "done":
+                result = event["result"]
+                if "error" in result:
+                    print(f"❌ Error: {result['error']}")
+                elif "error" in result["roi_analysis"]:
+                    print(f"❌ Error: {result['roi_analysis']['error']}")
+
+# Cell 10: Demo entry point (the old top-level notebook cells)
+def main(interactive=False):
+    test_connection()
+    check_sentiment_data()
+
+    result = kalshi_pure_vector_rag("New Jersey Governor Election")
+    print("\n💰 Pure Vector ROI Analysis:")
+    print(json.dumps(result, indent=2))
+
+    print("\n✅ Kalshi Pure Vector ROI Analysis System Ready!")
+    print("Use kalshi_pure_vector_rag('your question') for ROI-focused predictions")
+
+    if interactive:
+        interactive_roi_query()
+
+if __name__ == "__main__":
+    import sys
+    main(interactive="--interactive" in sys.argv)
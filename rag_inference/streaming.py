@@ -0,0 +1,90 @@
+import json
+
+
+def iter_text_deltas(event_stream):
+    """Text pieces from a Bedrock invoke_model_with_response_stream body (Anthropic messages API)"""
+    for event in event_stream:
+        chunk = event.get("chunk")
+        if chunk is None:
+            # modelStreamErrorException, throttlingException, ...
+            error = next(iter(event.items()), ("unknown", {}))
+            raise RuntimeError(f"Bedrock stream error {error[0]}: {error[1]}")
+        payload = json.loads(chunk["bytes"])
+        if payload.get("type") == "content_block_delta":
+            delta = payload.get("delta", {})
+            if delta.get("type") == "text_delta":
+                yield delta["text"]
+        elif payload.get("type") == "message_stop":
+            return
+
+
+class IncrementalJSONParser:
+    """Emits the top-level fields of a streamed JSON object as soon as each one is complete.
+
+    Text before the opening brace (prose, a ```json fence) is ignored. feed()
+    returns the (key, value) pairs completed by that chunk; result() parses
+    the whole object once it has closed.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.fields = {}
+        self.done = False
+        self._pos = 0
+        self._start = None        # index of the opening brace
+        self._field_start = None  # index just after the last top-level '{' or ','
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+
+    def feed(self, chunk):
+        self.text += chunk
+        completed = []
+        text = self.text
+        while self._pos < len(text) and not self.done:
+            ch = text[self._pos]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif self._start is None:
+                if ch == "{":
+                    self._start = self._field_start = self._pos + 1
+                    self._depth = 1
+            elif ch == '"':
+                self._in_string = True
+            elif ch in "{[":
+                self._depth += 1
+            elif ch in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    completed.extend(self._close_field(self._pos))
+                    self.done = True
+            elif ch == "," and self._depth == 1:
+                completed.extend(self._close_field(self._pos))
+                self._field_start = self._pos + 1
+            self._pos += 1
+        return completed
+
+    def _close_field(self, end):
+        piece = self.text[self._field_start:end].strip()
+        if not piece:
+            return []
+        try:
+            field = json.loads("{" + piece + "}")
+        except json.JSONDecodeError:
+            return []
+        self.fields.update(field)
+        return list(field.items())
+
+    def result(self):
+        """The parsed object, or None if it never closed or is not valid JSON"""
+        if not self.done:
+            return None
+        try:
+            return json.loads(self.text[self._start - 1:self._pos])
+        except json.JSONDecodeError:
+            return None
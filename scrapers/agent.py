@@ -9,17 +9,25 @@ import subprocess
 def generate_embedding(text: str):
     """
     Use Amazon Titan Embeddings to get vector embeddings for a string.
+    Same model and size as the vectors in kalshi_documents (Titan v2, 1024 dims
+    unless EMBED_MODEL_ID / EMBED_DIMENSION say otherwise).
     """
     bedrock = boto3.client("bedrock-runtime", region_name=os.getenv("AWS_REGION", "ap-southeast-2"))
-    model_id = "amazon.titan-embed-text-v1"
+    model_id = os.getenv("EMBED_MODEL_ID", "amazon.titan-embed-text-v2:0")
+    dimension = int(os.getenv("EMBED_DIMENSION", "1024"))
+    body = {"inputText": text}
+    if "titan-embed-text-v2" in model_id:
+        body["dimensions"] = dimension
     response = bedrock.invoke_model(
         modelId=model_id,
-        body=json.dumps({"inputText": text}),
+        body=json.dumps(body),
         contentType="application/json",
         accept="application/json"
     )
     result = json.loads(response["body"].read())
     embedding = result.get("embedding", [])
+    if len(embedding) != dimension:
+        raise ValueError(f"{model_id} returned {len(embedding)} dimensions, expected {dimension}")
     return embedding
 
 import subprocess
@@ -0,0 +1,465 @@
+import math
+import os
+import time
+
+import numpy as np
+
+INDEX_KINDS = ("ivfflat", "hnsw")
+# Session settings for index builds; the build is far faster when the graph /
+# centroid assignment fits in maintenance_work_mem
+INDEX_BUILD_MAINTENANCE_WORK_MEM = os.environ.get("INDEX_BUILD_MAINTENANCE_WORK_MEM", "2GB")
+INDEX_BUILD_PARALLEL_WORKERS = int(os.environ.get("INDEX_BUILD_PARALLEL_WORKERS", "4"))
+# pgvector rejects a larger hnsw.ef_search, which also bounds the rows one HNSW scan returns
+MAX_EF_SEARCH = 1000
+
+
+def ivfflat_lists(row_count):
+    """pgvector guidance: rows / 1000 lists up to 1M rows, sqrt(rows) beyond"""
+    if row_count > 1_000_000:
+        return int(math.sqrt(row_count))
+    return max(10, row_count // 1000)
+
+
+def recommended_params(kind, row_count):
+    """Build parameters for an index of this kind over row_count vectors"""
+    if kind == "ivfflat":
+        return {"lists": ivfflat_lists(row_count)}
+    if kind == "hnsw":
+        # Denser graphs pay off once the corpus outgrows the defaults (m=16, ef=64)
+        if row_count < 1_000_000:
+            return {"m": 16, "ef_construction": 64}
+        if row_count < 10_000_000:
+            return {"m": 24, "ef_construction": 128}
+        return {"m": 32, "ef_construction": 200}
+    raise ValueError(f"Unknown index kind {kind!r}, expected one of {INDEX_KINDS}")
+
+
+def recommended_search_settings(kind, params, k=10):
+    """Starting point for the per-query recall knob"""
+    if kind == "ivfflat":
+        return {"probes": max(1, int(math.sqrt(params["lists"])))}
+    return {"ef_search": max(40, 2 * k)}
+
+
+def apply_search_settings(cur, probes=None, ef_search=None):
+    """SET LOCAL the recall knobs for the current transaction only"""
+    if probes is not None:
+        cur.execute(f"SET LOCAL ivfflat.probes = {int(probes)}")
+    if ef_search is not None:
+        cur.execute(f"SET LOCAL hnsw.ef_search = {min(int(ef_search), MAX_EF_SEARCH)}")
+
+
+# Compact first-pass representations: an expression index over the quantized
+# column plus the matching ORDER BY, re-ranked against the full vector
+QUANTIZATIONS = {
+    # 2 bytes/dim, recall close to full precision
+    "halfvec": {
+        "expr": "({column}::halfvec({dim}))",
+        "opclass": "halfvec_cosine_ops",
+        "order": "{column}::halfvec({dim}) <=> %s::halfvec({dim})",
+    },
+    # 1 bit/dim, needs a wider shortlist
+    "binary": {
+        "expr": "(binary_quantize({column})::bit({dim}))",
+        "opclass": "bit_hamming_ops",
+        "order": "binary_quantize({column})::bit({dim}) <~> binary_quantize(%s::vector)",
+    },
+}
+# Shortlist size as a multiple of k for the exact re-rank
+RERANK_FACTOR = {"halfvec": 4, "binary": 10}
+
+
+def shortlist_size(quantization, k, factor=None):
+    """Candidates to re-rank: factor (default RERANK_FACTOR) x k, capped at MAX_EF_SEARCH"""
+    return max(k, min(k * (factor or RERANK_FACTOR[quantization]), MAX_EF_SEARCH))
+
+
+def quantized_order(quantization, column="embedding", dim=1024):
+    """ORDER BY expression (one %s for the query vector) that can use the quantized index"""
+    if quantization not in QUANTIZATIONS:
+        raise ValueError(f"Unknown quantization {quantization!r}, expected one of {tuple(QUANTIZATIONS)}")
+    return QUANTIZATIONS[quantization]["order"].format(column=column, dim=dim)
+
+
+def build_settings(maintenance_work_mem=None, parallel_workers=None):
+    """maintenance_work_mem / parallel worker settings applied around index builds"""
+    return {
+        "maintenance_work_mem": maintenance_work_mem or INDEX_BUILD_MAINTENANCE_WORK_MEM,
+        "max_parallel_maintenance_workers": INDEX_BUILD_PARALLEL_WORKERS if parallel_workers is None else parallel_workers,
+    }
+
+
+class VectorIndexManager:
+    """Create, rebuild, switch and tune the ANN index on a vector column"""
+
+    def __init__(self, conn, table="kalshi_documents", column="embedding",
+                 index_name="kalshi_embedding_idx", opclass="vector_cosine_ops", distance_op="<=>", dim=1024):
+        self.conn = conn
+        self.dim = dim
+        self.table = table
+        self.column = column
+        self.index_name = index_name
+        self.opclass = opclass
+        self.distance_op = distance_op
+
+    # ------------------------------------------------------------------
+    # Introspection
+    # ------------------------------------------------------------------
+
+    def row_count(self, exact=False):
+        with self.conn.cursor() as cur:
+            if exact:
+                cur.execute(f"SELECT COUNT(*) FROM {self.table} WHERE {self.column} IS NOT NULL")
+            else:
+                # Planner estimate, free on large tables; -1 means never analyzed
+                cur.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass", (self.table,))
+            count = cur.fetchone()[0]
+        self.conn.rollback()
+        return count if count >= 0 else self.row_count(exact=True)
+
+    def partition_count(self):
+        """Number of partitions, or 0 for an ordinary table"""
+        with self.conn.cursor() as cur:
+            cur.execute("""
+                SELECT c.relkind, (SELECT COUNT(*) FROM pg_inherits WHERE inhparent = c.oid)
+                FROM pg_class c WHERE c.oid = %s::regclass
+            """, (self.table,))
+            relkind, partitions = cur.fetchone()
+        self.conn.rollback()
+        return partitions if relkind == 'p' else 0
+
+    def _build_params(self, kind):
+        # On a partitioned table every partition gets its own index, sized for its share of rows
+        rows = self.row_count(exact=True)
+        return recommended_params(kind, rows // max(1, self.partition_count()))
+
+    def current_index(self):
+        """(kind, reloptions) of the managed index, or None if it does not exist"""
+        with self.conn.cursor() as cur:
+            cur.execute("""
+                SELECT am.amname, c.reloptions
+                FROM pg_class c JOIN pg_am am ON am.oid = c.relam
+                WHERE c.relname = %s AND c.relkind IN ('i', 'I')
+            """, (self.index_name,))
+            row = cur.fetchone()
+        self.conn.rollback()
+        if row is None:
+            return None
+        options = dict(opt.split("=", 1) for opt in (row[1] or []))
+        return row[0], {key: int(value) for key, value in options.items()}
+
+    # ------------------------------------------------------------------
+    # Build / rebuild / switch
+    # ------------------------------------------------------------------
+
+    def _using_sql(self, kind, params, expr=None, opclass=None):
+        options = ", ".join(f"{key} = {int(value)}" for key, value in params.items())
+        return f"USING {kind} ({expr or self.column} {opclass or self.opclass}) WITH ({options})"
+
+    def _create_sql(self, name, kind, params, concurrently):
+        return (
+            f"CREATE INDEX {'CONCURRENTLY ' if concurrently else ''}{name} "
+            f"ON {self.table} {self._using_sql(kind, params)}"
+        )
+
+    def _create_partitioned_concurrently(self, name, using):
+        """Build a partitioned index without blocking writes.
+
+        Postgres can't CREATE INDEX CONCURRENTLY on a partitioned table, so the
+        parent is created ON ONLY the table (invalid, nothing built), each
+        partition's index is built concurrently and attached, and the parent
+        turns valid once every partition has one. Re-running resumes with the
+        partitions that are not attached yet.
+        """
+        self._run_ddl([f"CREATE INDEX IF NOT EXISTS {name} ON ONLY {self.table} {using}"], concurrently=False)
+        with self.conn.cursor() as cur:
+            cur.execute("""
+                SELECT p.inhrelid::regclass::text, p.inhrelid
+                FROM pg_inherits p
+                WHERE p.inhparent = %s::regclass
+                  AND NOT EXISTS (
+                      SELECT 1 FROM pg_inherits i JOIN pg_index x ON x.indexrelid = i.inhrelid
+                      WHERE i.inhparent = %s::regclass AND x.indrelid = p.inhrelid
+                  )
+                ORDER BY 1
+            """, (self.table, name))
+            partitions = cur.fetchall()
+        self.conn.rollback()
+        for partition, oid in partitions:
+            # Partition oids keep child names unique and under the 63-byte limit
+            child = f"{name[:48]}_{oid}"
+            # An interrupted concurrent build leaves an invalid index behind
+            self._run_ddl([f"DROP INDEX CONCURRENTLY IF EXISTS {child}",
+                           f"CREATE INDEX CONCURRENTLY {child} ON {partition} {using}"],
+                          concurrently=True, settings=build_settings())
+            self._run_ddl([f"ALTER INDEX {name} ATTACH PARTITION {child}"], concurrently=False)
+
+    def create_index(self, kind="ivfflat", params=None, concurrently=False, analyze=False, settings=None):
+        """Create the index if missing, sized from the current row count unless params are given.
+
+        settings overrides build_settings(); analyze=True refreshes planner
+        statistics afterwards (what a bulk load wants). concurrently=True on a
+        partitioned table builds partition by partition, see
+        _create_partitioned_concurrently.
+        """
+        current = self.current_index()
+        if current is not None and current[0] != kind:
+            print(f"⚠️ {self.index_name} is already {current[0]} {current[1]}, not {kind}; keeping it "
+                  f"(switch_index({kind!r}) rebuilds it without blocking writes)")
+            return current
+        partitioned = concurrently and self.partition_count()
+        # A partitioned index left invalid by an interrupted concurrent build is resumed
+        if current is not None and not partitioned:
+            return current
+        params = params or (current[1] if current else self._build_params(kind))
+        started = time.perf_counter()
+        if partitioned:
+            self._create_partitioned_concurrently(self.index_name, self._using_sql(kind, params))
+        else:
+            self._run_ddl([self._create_sql(self.index_name, kind, params, concurrently)], concurrently,
+                          settings=settings or build_settings())
+        print(f"✅ Created {kind} index {self.index_name} {params} in {time.perf_counter() - started:.1f}s")
+        if analyze:
+            self._run_ddl([f"ANALYZE {self.table}"], concurrently=False)
+        return kind, params
+
+    def rebuild_index(self, kind=None, params=None, concurrently=True):
+        """Build a replacement index alongside the old one, then swap names.
+
+        With concurrently=True, reads and writes continue during the build and
+        queries keep using the old index until the swap; a partitioned table
+        is built partition by partition (_create_partitioned_concurrently).
+        """
+        current = self.current_index()
+        kind = kind or (current[0] if current else "ivfflat")
+        if kind not in INDEX_KINDS:
+            raise ValueError(f"Unknown index kind {kind!r}, expected one of {INDEX_KINDS}")
+        params = params or self._build_params(kind)
+        partitioned = concurrently and self.partition_count()
+
+        new_name = f"{self.index_name}_new"
+        if partitioned:
+            # A leftover partitioned index can't be dropped concurrently, but nothing uses it
+            self._run_ddl([f"DROP INDEX IF EXISTS {new_name}"], concurrently=False)
+            self._create_partitioned_concurrently(new_name, self._using_sql(kind, params))
+        else:
+            statements = [f"DROP INDEX {'CONCURRENTLY ' if concurrently else ''}IF EXISTS {new_name}",
+                          self._create_sql(new_name, kind, params, concurrently)]
+            self._run_ddl(statements, concurrently, settings=build_settings())
+        # Swap in one short transaction; partition indexes take the final name too,
+        # so the next rebuild's {new_name}_<oid> children don't collide with them
+        self._run_ddl([f"DROP INDEX IF EXISTS {self.index_name}",
+                       f"ALTER INDEX {new_name} RENAME TO {self.index_name}",
+                       *self._rename_partition_indexes(new_name, self.index_name)], concurrently=False)
+        print(f"✅ Rebuilt {self.index_name} as {kind} {params}")
+        return kind, params
+
+    def _rename_partition_indexes(self, parent, name):
+        """ALTER INDEX statements giving parent's partition indexes _create_partitioned_concurrently names for name"""
+        with self.conn.cursor() as cur:
+            cur.execute("""
+                SELECT i.inhrelid::regclass::text, x.indrelid
+                FROM pg_inherits i JOIN pg_index x ON x.indexrelid = i.inhrelid
+                WHERE i.inhparent = to_regclass(%s)
+            """, (parent,))
+            children = cur.fetchall()
+        self.conn.rollback()
+        return [f"ALTER INDEX {child} RENAME TO {name[:48]}_{oid}" for child, oid in children
+                if child != f"{name[:48]}_{oid}"]
+
+    def switch_index(self, kind, params=None):
+        """Move between ivfflat and HNSW (no-op if already that kind)"""
+        current = self.current_index()
+        if current and current[0] == kind and params is None:
+            return current
+        return self.rebuild_index(kind, params)
+
+    def drop_index(self):
+        self._run_ddl([f"DROP INDEX IF EXISTS {self.index_name}"], concurrently=False)
+
+    def quantized_index_name(self, quantization):
+        return f"{self.index_name[:-len('_idx')] if self.index_name.endswith('_idx') else self.index_name}_{quantization}_idx"
+
+    def create_quantized_index(self, quantization, kind="hnsw", params=None, concurrently=False):
+        """Expression index over halfvec(dim) or binary_quantize(column) for quantized first-pass search"""
+        spec = QUANTIZATIONS[quantization]
+        params = params or self._build_params(kind)
+        name = self.quantized_index_name(quantization)
+        using = self._using_sql(kind, params, spec["expr"].format(column=self.column, dim=self.dim), spec["opclass"])
+        if concurrently and self.partition_count():
+            self._create_partitioned_concurrently(name, using)
+        else:
+            self._run_ddl([f"CREATE INDEX {'CONCURRENTLY ' if concurrently else ''}IF NOT EXISTS {name} "
+                           f"ON {self.table} {using}"], concurrently, settings=build_settings())
+        print(f"✅ Created {quantization} {kind} index {name} {params}")
+        return name
+
+    def index_sizes(self, names):
+        """{index name: bytes}, summed over partitions for an index on a partitioned table"""
+        sizes = {}
+        with self.conn.cursor() as cur:
+            for name in names:
+                cur.execute("""
+                    SELECT COALESCE(SUM(pg_relation_size(relid)), 0)
+                    FROM pg_partition_tree(to_regclass(%s))
+                """, (name,))
+                sizes[name] = int(cur.fetchone()[0])
+        self.conn.rollback()
+        return sizes
+
+    def _run_ddl(self, statements, concurrently, settings=None):
+        # CONCURRENTLY cannot run inside a transaction block
+        self.conn.commit()
+        previous = self.conn.autocommit
+        self.conn.autocommit = concurrently
+        try:
+            with self.conn.cursor() as cur:
+                # Transaction-local unless autocommit, where they are reset by hand below
+                for name, value in (settings or {}).items():
+                    cur.execute("SELECT set_config(%s, %s, %s)", (name, str(value), not concurrently))
+                try:
+                    for statement in statements:
+                        cur.execute(statement)
+                finally:
+                    if concurrently:
+                        for name in settings or {}:
+                            cur.execute(f"RESET {name}")
+            if not concurrently:
+                self.conn.commit()
+        except Exception:
+            if not concurrently:
+                self.conn.rollback()
+            raise
+        finally:
+            self.conn.autocommit = previous
+
+    # ------------------------------------------------------------------
+    # Query-time knobs and measurement
+    # ------------------------------------------------------------------
+
+    def default_search_settings(self, k=10):
+        current = self.current_index()
+        if current is None:
+            return {}
+        return recommended_search_settings(current[0], current[1], k)
+
+    def _top_ids(self, cur, query_vector, k, quantization=None, candidates=None):
+        if quantization is None:
+            cur.execute(f"""
+                SELECT id FROM {self.table}
+                ORDER BY {self.column} {self.distance_op} %s::vector
+                LIMIT %s
+            """, (query_vector, k))
+        else:
+            # Shortlist on the quantized index, then exact re-rank on the full vectors
+            cur.execute(f"""
+                SELECT id FROM (
+                    SELECT id, {self.column} FROM {self.table}
+                    ORDER BY {quantized_order(quantization, self.column, self.dim)}
+                    LIMIT %s
+                ) shortlist
+                ORDER BY {self.column} {self.distance_op} %s::vector
+                LIMIT %s
+            """, (query_vector, candidates or shortlist_size(quantization, k), query_vector, k))
+        return [row[0] for row in cur.fetchall()]
+
+    def exact_top_ids(self, query_vector, k):
+        """Ground truth by sequential scan (index scans disabled for this transaction)"""
+        with self.conn.cursor() as cur:
+            cur.execute("SET LOCAL enable_indexscan = off")
+            cur.execute("SET LOCAL enable_bitmapscan = off")
+            ids = self._top_ids(cur, query_vector, k)
+        self.conn.rollback()
+        return ids
+
+    def measure_recall(self, query_vectors, k=10, settings=None):
+        """Recall@k and latency of ANN search against exact search.
+
+        settings is a list of dicts like {"probes": 10} or {"ef_search": 80};
+        returns one report row per setting.
+        """
+        vectors = [_vector_literal(v) for v in query_vectors]
+        truth = [set(self.exact_top_ids(v, k)) for v in vectors]
+        settings = settings or [self.default_search_settings(k)]
+
+        report = []
+        for setting in settings:
+            latencies, recalls = [], []
+            for vector, expected in zip(vectors, truth):
+                with self.conn.cursor() as cur:
+                    apply_search_settings(cur, **setting)
+                    start = time.perf_counter()
+                    found = self._top_ids(cur, vector, k)
+                    latencies.append(time.perf_counter() - start)
+                self.conn.rollback()
+                recalls.append(len(expected.intersection(found)) / max(1, len(expected)))
+            ms = np.asarray(latencies) * 1000.0
+            report.append({
+                **setting,
+                "recall": float(np.mean(recalls)),
+                "p50_ms": float(np.percentile(ms, 50)),
+                "p95_ms": float(np.percentile(ms, 95)),
+            })
+            print(f"  {setting}: recall@{k}={report[-1]['recall']:.3f} p50={report[-1]['p50_ms']:.2f}ms")
+        return report
+
+    def quantized_recall_report(self, query_vectors, k=10, quantizations=("halfvec", "binary"), factors=(1, 2, 4, 10, 20)):
+        """Recall@k / latency of quantized shortlist + exact re-rank, per shortlist size, plus index sizes.
+
+        Assumes create_quantized_index() has been run for each quantization.
+        """
+        vectors = [_vector_literal(v) for v in query_vectors]
+        truth = [set(self.exact_top_ids(v, k)) for v in vectors]
+        report = []
+        for quantization in quantizations:
+            for factor in factors:
+                candidates = shortlist_size(quantization, k, factor)
+                latencies, recalls = [], []
+                for vector, expected in zip(vectors, truth):
+                    with self.conn.cursor() as cur:
+                        # HNSW returns at most ef_search rows
+                        apply_search_settings(cur, ef_search=max(40, candidates))
+                        start = time.perf_counter()
+                        found = self._top_ids(cur, vector, k, quantization, candidates)
+                        latencies.append(time.perf_counter() - start)
+                    self.conn.rollback()
+                    recalls.append(len(expected.intersection(found)) / max(1, len(expected)))
+                ms = np.asarray(latencies) * 1000.0
+                report.append({
+                    "quantization": quantization,
+                    "candidates": candidates,
+                    "recall": float(np.mean(recalls)),
+                    "p50_ms": float(np.percentile(ms, 50)),
+                    "p95_ms": float(np.percentile(ms, 95)),
+                })
+                print(f"  {quantization} x{factor}: recall@{k}={report[-1]['recall']:.3f} "
+                      f"p50={report[-1]['p50_ms']:.2f}ms")
+
+        sizes = self.index_sizes([self.index_name] + [self.quantized_index_name(q) for q in quantizations])
+        for name, size in sizes.items():
+            print(f"  {name}: {size / (1024 * 1024):.1f} MB")
+        return report, sizes
+
+    def auto_tune(self, query_vectors, k=10, target_recall=0.95):
+        """Smallest probes/ef_search that reaches target_recall on the sample queries"""
+        current = self.current_index()
+        if current is None:
+            raise RuntimeError(f"{self.index_name} does not exist")
+        kind, params = current
+        if kind == "ivfflat":
+            candidates = sorted({p for p in (1, 2, 4, 8, 16, 32, 64, 128, 256) if p <= params["lists"]} | {params["lists"]})
+            settings = [{"probes": p} for p in candidates]
+        else:
+            settings = [{"ef_search": ef} for ef in (max(k, 10), 20, 40, 80, 160, 320, 640) if ef >= k]
+
+        report = self.measure_recall(query_vectors, k, settings)
+        for row in report:
+            if row["recall"] >= target_recall:
+                return row, report
+        return report[-1], report
+
+
+def _vector_literal(vector):
+    if isinstance(vector, str):
+        return vector
+    return "[" + ",".join(f"{x:.8g}" for x in vector) + "]"